@@ -5,8 +5,13 @@
 echo "Waiting for redis to start"
 /usr/local/wait-for-it.sh --strict redis:6379
 
-echo "Waiting for mongo to start"
-/usr/local/wait-for-it.sh --strict mongo:27017
-
 cd /dragg/dragg
-python3 main.py
+if [ "$DRAGG_ROLE" = "worker" ]; then
+    # Serves the home solves of an aggregator run with executor = "redis"
+    python3 -m dragg.worker --n-procs ${N_PROCS:-1}
+else
+    echo "Waiting for mongo to start"
+    /usr/local/wait-for-it.sh --strict mongo:27017
+
+    python3 main.py
+fi
@@ -20,13 +20,12 @@ import redis
 from sklearn.linear_model import Ridge
 import scipy.stats
 from abc import ABC, abstractmethod
-import pathos
-from pathos.pools import ProcessPool
 
 # Local
 from dragg.mpc_calc import MPCCalc
 from dragg.redis_client import RedisClient
 from dragg.logger import Logger
+from dragg.executors import get_executor
 
 # class Experience:
 #     def __init__(self, state, action, reward, next_state):
@@ -36,8 +35,37 @@ from dragg.logger import Logger
 #         self.next_state = next_state
 #
 #     def process(self)
-def manage_experience_processing(exp):
-    return
+def state_action_basis(state, action):
+    """
+    Features of the critic's linear Q function.
+    :return: numpy.ndarray
+    """
+    action_basis = np.array([1, action, action**2])
+    delta_action_basis = np.array([1, state['delta_action'], state['delta_action']**2])
+    time_basis = np.array([1, np.sin(2 * np.pi * state["time_of_day"]), np.cos(2 * np.pi * state["time_of_day"])])
+    forecast_error_basis = np.array([1, state["fcst_error"], state["fcst_error"]**2])
+    forecast_trend_basis = np.array([1, state["forecast_trend"], state["forecast_trend"]**2])
+
+    v = np.outer(forecast_trend_basis, action_basis).flatten()[1:]
+    w = np.outer(forecast_error_basis, action_basis).flatten()[1:] #8
+    z = np.outer(forecast_error_basis, delta_action_basis).flatten()[1:] #14
+    phi = np.concatenate((v, w, z))
+    phi = np.outer(phi, time_basis).flatten()[1:]
+
+    return phi
+
+def manage_experience_processing(item):
+    """
+    Top level function (picklizable by pathos) computing the critic's target for
+    one experience, from plain arguments so that the agent and its executor are
+    not sent to the workers.
+    :param item: tuple (experience, next action, theta_q, beta)
+    :return: float, reward + beta * min over the Q networks of Q(next state, next action)
+    """
+    exp, u1, theta_q, beta = item
+    xu_k1 = state_action_basis(exp["next_state"], u1)
+    q_k1 = min(theta_q[:,i] @ xu_k1 for i in range(theta_q.shape[1]))
+    return exp["reward"] + beta * q_k1
 
 class RLAgent(ABC):
     def __init__(self, parameters, rl_log):
@@ -59,6 +87,7 @@ class RLAgent(ABC):
         self.i = 0
         self.z_theta_mu = 0
         self.lam_theta = 0.01
+        self.executor = None # Set by update_qfunction
 
         self.rl_data = {} #self.set_rl_data()
         self.set_rl_data()
@@ -96,19 +125,7 @@ class RLAgent(ABC):
         return phi
 
     def state_action_basis(self, state, action):
-        action_basis = np.array([1, action, action**2])
-        delta_action_basis = np.array([1, state['delta_action'], state['delta_action']**2])
-        time_basis = np.array([1, np.sin(2 * np.pi * state["time_of_day"]), np.cos(2 * np.pi * state["time_of_day"])])
-        forecast_error_basis = np.array([1, state["fcst_error"], state["fcst_error"]**2])
-        forecast_trend_basis = np.array([1, state["forecast_trend"], state["forecast_trend"]**2])
-
-        v = np.outer(forecast_trend_basis, action_basis).flatten()[1:]
-        w = np.outer(forecast_error_basis, action_basis).flatten()[1:] #8
-        z = np.outer(forecast_error_basis, delta_action_basis).flatten()[1:] #14
-        phi = np.concatenate((v, w, z))
-        phi = np.outer(phi, time_basis).flatten()[1:]
-
-        return phi
+        return state_action_basis(state, action)
 
     @abstractmethod
     def reward(self):
@@ -176,15 +193,11 @@ class RLAgent(ABC):
         return y, xu_k
 
     def process_exp(self, exp):
-        x = exp["state"]
-        x1 = exp["next_state"]
-        u = exp["action"]
-        u1 = self.get_policy_action(x1)
-        xu_k = self.state_action_basis(x,u)
-        xu_k1 = self.state_action_basis(x1,u1)
-        q_k1 = min(self.theta_q[:,i] @ xu_k1 for i in range(self.theta_q.shape[1]))
-        y = exp["reward"] + self.BETA * q_k1
-        return y
+        """
+        :return: tuple, the arguments of manage_experience_processing for an
+        experience, with the next action drawn from the current policy
+        """
+        return exp, self.get_policy_action(exp["next_state"]), self.theta_q, self.BETA
 
     def update_qfunction(self):
         if self.TWIN_Q:
@@ -203,8 +216,13 @@ class RLAgent(ABC):
         if len(self.memory) > self.BATCH_SIZE:
             batch = random.sample(self.memory, self.BATCH_SIZE)
 
-            pool = ProcessPool(nodes=self.config['simulation']['n_nodes'])
-            batch_y = np.array(pool.map(self.process_exp, batch))
+            if self.executor is None:
+                self.executor = get_executor(self.config['simulation'], Logger("rl_agent").logger)
+            batch_y, failed = self.executor.map(manage_experience_processing, [self.process_exp(exp) for exp in batch], name=lambda item: "experience")
+            if len(failed) > 0: # keep the experiences that were processed
+                batch = [exp for exp, y in zip(batch, batch_y) if y is not None]
+                batch_y = [y for y in batch_y if y is not None]
+            batch_y = np.array(batch_y)
             batch_phi = np.array([self.state_action_basis(exp['state'],exp['action']) for exp in batch])
 
             clf = Ridge(alpha = 0.01)
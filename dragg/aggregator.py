@@ -12,22 +12,50 @@ import time
 import numpy as np
 import json
 import toml
+import pickle
+import hashlib
 import random
 import names
 import string
 import itertools as it
 import redis
 import pathos
-from pathos.pools import ProcessPool
+from copy import copy, deepcopy
 
 # Local
-from dragg.mpc_calc import MPCCalc, manage_home
+from dragg.mpc_calc import MPCCalc, manage_home, propose_home
 from dragg.redis_client import RedisClient
 from dragg.logger import Logger
+from dragg.rl_sweep import RLSweep
+from dragg.surrogate import LoadSurrogate
+from dragg.archetypes import cluster_homes
+from dragg.benchmark import SolveBenchmark
+from dragg.executors import get_executor
+from dragg.scheduler import SolveScheduler
+from dragg.shards import Shard, reduce_shard, parse_bid_curve
+
+# Aggregator attributes saved by write_checkpoint, everything that carries over
+# from one timestep to the next
+CHECKPOINT_ATTRIBUTES = ["timestep", "collected_data", "baseline_agg_load_list", "n_dispatched",
+    "coordination_log", "scheduler", "history_loaded", "all_rps", "all_sps", "reward_price",
+    "agg_load", "forecast_load", "agg_cost", "agg_setpoint", "tracked_loads", "avg_load",
+    "max_load", "min_load", "house_load", "forecast_house_load", "bid_curve", "surrogate"]
+# Checkpointed attributes set up from the config (bid_curve follows bid_prices),
+# a branch keeps its own rather than the prefix's
+BRANCH_OWN_ATTRIBUTES = ["history_loaded", "scheduler", "bid_curve", "surrogate"]
 
 class Aggregator:
-    def __init__(self):
+    def __init__(self, config=None, shared_data=None):
+        """
+        :param config: dictionary, used instead of the config file (e.g. one case of
+        a ParameterSweep)
+        :param shared_data: dictionary of data already parsed by another aggregator,
+        {"ts_data": {subhourly_steps: pandas.DataFrame}, "spp_data": {load_zone:
+        pandas.DataFrame}, "homes": {population key: list of homes}}, see ParameterSweep.
+        Data parsed by this aggregator is added to it.
+        """
         self.log = Logger("aggregator")
+        self.shared_data = shared_data if shared_data is not None else {}
         self.data_dir = os.path.expanduser(os.environ.get('DATA_DIR','data'))
         self.outputs_dir = os.path.join('outputs')
         if not os.path.isdir(self.outputs_dir):
@@ -65,7 +93,10 @@ class Aggregator:
         self.num_timesteps = None  # Set by _set_dt
         self.all_homes = None  # Set by get_homes
         self.redis_client = RedisClient()
-        self.config = self._import_config()
+        self.config = self._import_config(config)
+        if self.config['simulation'].get('redis_namespace', ''):
+            self.redis_client.namespace = self.config['simulation']['redis_namespace']
+            os.environ['REDIS_NAMESPACE'] = self.redis_client.namespace # inherited by local worker processes
         self.check_type = self.config['simulation']['check_type']  # One of: 'pv_only', 'base', 'battery_only', 'pv_battery', 'all'
 
         self.thermal_trend = None
@@ -84,27 +115,50 @@ class Aggregator:
         self.all_sps = np.zeros(self.num_timesteps)
 
         self.case = "baseline"
-
-    def _import_config(self):
-        if not os.path.exists(self.config_file):
-            self.log.logger.error(f"Configuration file does not exist: {self.config_file}")
-            sys.exit(1)
-        with open(self.config_file, 'r') as f:
-            data = toml.load(f)
-            d_keys = set(data.keys())
-            req_keys = set(self.required_keys.keys())
-            if not req_keys.issubset(d_keys):
-                missing_keys = req_keys - d_keys
-                self.log.logger.error(f"{missing_keys} must be configured in the config file.")
+        self.surrogate = None # Set by setup_surrogate
+        self.bid_prices = np.array(self.config['home']['hems'].get('bid_prices', []), dtype=float)
+        self.bid_curve = None # Set by collect_data when bid_prices are configured
+        self.home_weights = {} # Set by set_archetypes, number of homes each solved home stands for
+        self.archetypes = None # Set by set_archetypes
+        self.validation_homes = [] # Set by set_archetypes
+        self.horizon = max(1, int(self.config['home']['hems']['prediction_horizon'] * self.dt))
+        self.resolve_every = int(np.clip(self.config['home']['hems'].get('resolve_every', 1), 1, self.horizon)) # a plan covers at most one horizon
+        self.n_dispatched = [] # number of homes sent to the solver pool at each timestep
+        self.timestep_budget = float(self.config['simulation'].get('timestep_budget', 0)) # s, 0 for no budget
+        self.track_late_solves = self.timestep_budget > 0 or self.config['home']['hems'].get('solver_time_limit', 0) > 0
+        self.executor = get_executor(self.config['simulation'], self.log.logger)
+        self.load_balancing = self.config['simulation'].get('load_balancing', False)
+        self.scheduler = SolveScheduler(self.config['simulation'].get('solve_time_smoothing', 0.3))
+        self.n_shards = self.config['agg'].get('n_shards', 0) # 0 collects every home at the root
+        self.shards = None # Set by set_shards
+        self.history_loaded = {} # number of history entries of each home read by load_shard_history
+        self.coordination = self.config['agg'].get('coordination', {})
+        self.coordination_log = [] # iterations, residual and wall time of each coordinated timestep
+        self.resumed_run_time = 0 # s, run time before the checkpoint, set by load_checkpoint
+
+    def _import_config(self, config=None):
+        if config is None:
+            if not os.path.exists(self.config_file):
+                self.log.logger.error(f"Configuration file does not exist: {self.config_file}")
                 sys.exit(1)
-            else:
-                for subsystem in self.required_keys.keys():
-                    req_keys = set(self.required_keys[subsystem])
-                    given_keys = set(data[subsystem])
-                    if not req_keys.issubset(given_keys):
-                        missing_keys = req_keys - given_keys
-                        self.log.logger.error(f"Parameters for {subsystem}: {missing_keys} must be specified in the config file.")
-                        sys.exit(1)
+            with open(self.config_file, 'r') as f:
+                data = toml.load(f)
+        else:
+            data = config
+        d_keys = set(data.keys())
+        req_keys = set(self.required_keys.keys())
+        if not req_keys.issubset(d_keys):
+            missing_keys = req_keys - d_keys
+            self.log.logger.error(f"{missing_keys} must be configured in the config file.")
+            sys.exit(1)
+        else:
+            for subsystem in self.required_keys.keys():
+                req_keys = set(self.required_keys[subsystem])
+                given_keys = set(data[subsystem])
+                if not req_keys.issubset(given_keys):
+                    missing_keys = req_keys - given_keys
+                    self.log.logger.error(f"Parameters for {subsystem}: {missing_keys} must be specified in the config file.")
+                    sys.exit(1)
         self.log.logger.info(f"Set the version write out to {data['simulation']['named_version']}")
         return data
 
@@ -130,31 +184,35 @@ class Aggregator:
         """
         Import timeseries data from file downloaded from NREL NSRDB.  The function removes the top two
         lines.  Columns which must be present: ["Year", "Month", "Day", "Hour", "Minute", "Temperature", "GHI"]
-        Renames 'Temperature' to 'OAT'
+        Renames 'Temperature' to 'OAT'. Reuses the data of shared_data when it was
+        already parsed for the same subhourly_steps.
         :return: pandas.DataFrame, columns: ts, GHI, OAT
         """
-        if not os.path.exists(self.ts_data_file):
-            self.log.logger.error(f"Timeseries data file does not exist: {self.ts_data_file}")
-            sys.exit(1)
-
-        df = pd.read_csv(self.ts_data_file, skiprows=2)
         self.dt = int(self.config['agg']['subhourly_steps'])
         self.dt_interval = 60 // self.dt
-        reps = [np.ceil(self.dt/2) if val==0 else np.floor(self.dt/2) for val in df.Minute]
-        df = df.loc[np.repeat(df.index.values, reps)]
-        interval_minutes = self.dt_interval * np.arange(self.dt)
-        n_intervals = len(df.index) // self.dt
-        x = np.tile(interval_minutes, n_intervals)
-        df.Minute = x
-        df = df.astype(str)
-        df['ts'] = df[["Year", "Month", "Day", "Hour", "Minute"]].apply(lambda x: ' '.join(x), axis=1)
-        df = df.rename(columns={"Temperature": "OAT"})
-        df["ts"] = df["ts"].apply(lambda x: datetime.strptime(x, '%Y %m %d %H %M'))
-        df = df.filter(["ts", "GHI", "OAT"])
-        df[["GHI", "OAT"]] = df[["GHI", "OAT"]].astype(int)
+        df = self.shared_data.get("ts_data", {}).get(self.dt)
+        if df is None:
+            if not os.path.exists(self.ts_data_file):
+                self.log.logger.error(f"Timeseries data file does not exist: {self.ts_data_file}")
+                sys.exit(1)
+
+            df = pd.read_csv(self.ts_data_file, skiprows=2)
+            reps = [np.ceil(self.dt/2) if val==0 else np.floor(self.dt/2) for val in df.Minute]
+            df = df.loc[np.repeat(df.index.values, reps)]
+            interval_minutes = self.dt_interval * np.arange(self.dt)
+            n_intervals = len(df.index) // self.dt
+            x = np.tile(interval_minutes, n_intervals)
+            df.Minute = x
+            df = df.astype(str)
+            df['ts'] = df[["Year", "Month", "Day", "Hour", "Minute"]].apply(lambda x: ' '.join(x), axis=1)
+            df = df.rename(columns={"Temperature": "OAT"})
+            df["ts"] = df["ts"].apply(lambda x: datetime.strptime(x, '%Y %m %d %H %M'))
+            df = df.filter(["ts", "GHI", "OAT"])
+            df[["GHI", "OAT"]] = df[["GHI", "OAT"]].astype(int)
+            df = df.set_index('ts')
+            self.shared_data.setdefault("ts_data", {})[self.dt] = df
         self.oat = df['OAT'].to_numpy()
         self.ghi = df['GHI'].to_numpy()
-        df = df.set_index('ts')
 
         day_of_year = 0
         self.thermal_trend = self.oat[4 * self.dt] - self.oat[0]
@@ -175,6 +233,10 @@ class Aggregator:
         if not self.config['agg']['spp_enabled']:
             return
 
+        load_zone = self.config['simulation']['load_zone']
+        if load_zone in self.shared_data.get("spp_data", {}):
+            return self.shared_data["spp_data"][load_zone]
+
         if not os.path.exists(self.spp_data_file):
             self.log.logger.error(f"SPP data file does not exist: {self.spp_data_file}")
             sys.exit(1)
@@ -188,7 +250,7 @@ class Aggregator:
             else:
                 df = df.append(v, ignore_index=True)
 
-        df = df[df["Settlement Point"] == self.config['simulation']['load_zone']]
+        df = df[df["Settlement Point"] == load_zone]
         df["Hour Ending"] = df["Hour Ending"].str.replace(':00', '')
         df["Hour Ending"] = df["Hour Ending"].apply(pd.to_numeric)
         df["Hour Ending"] = df["Hour Ending"].apply(lambda x: x - 1)
@@ -201,6 +263,7 @@ class Aggregator:
         df["ts"] = datetime.strptime(df['ts'], '%m/%d/%Y %H')
         df["SPP"] = df['SPP'] / 1000
         df = df.set_index('ts')
+        self.shared_data.setdefault("spp_data", {})[load_zone] = df
         return df
 
     def _build_tou_price(self):
@@ -261,14 +324,118 @@ class Aggregator:
         self.config['simulation']['random_seed'] = new_seed
 
     def get_homes(self):
-        homes_file = os.path.join(self.outputs_dir, f"all_homes-{self.config['community']['total_number_homes']}-config.json")
-        if not self.config['community']['overwrite_existing'] and os.path.isfile(homes_file):
-            with open(homes_file) as f:
-                self.all_homes = json.load(f)
-        else:
+        """
+        Reads the homes from the population cache or creates them. Homes of
+        shared_data with the same population key are reused with this run's HEMS
+        parameters.
+        :return: None
+        """
+        key = self.population_key()
+        if key in self.shared_data.get("homes", {}):
+            hems = self.hems_config()
+            self.all_homes = [{**deepcopy(home), "hems": hems} for home in self.shared_data["homes"][key]]
+            self._check_home_configs()
+            self.set_home_objects()
+            return
+
+        population_file = self.population_file()
+        if self.config['community']['overwrite_existing'] or not os.path.isfile(population_file):
             self.create_homes()
+            self.write_population(population_file)
+        self.read_population(population_file)
+        self.set_home_objects()
         self._check_home_configs()
         self.write_home_configs()
+        self.shared_data.setdefault("homes", {})[key] = self.all_homes
+
+    def population_key(self):
+        """
+        :return: str, the parameters the homes are generated from (all but the HEMS
+        parameters)
+        """
+        return json.dumps({
+            "community": {k: self.config['community'][k] for k in ["total_number_homes", "homes_battery", "homes_pv", "homes_pv_battery"]},
+            "home": {k: v for k, v in self.config['home'].items() if k != 'hems'},
+            "random_seed": self.config['simulation']['random_seed'],
+            "start_datetime": self.config['simulation']['start_datetime'],
+            "end_datetime": self.config['simulation']['end_datetime'],
+            "subhourly_steps": self.dt
+        }, sort_keys=True)
+
+    def population_file(self):
+        """
+        :return: str, file of the population cache, named after the sha256 of the
+        population key and of the water draw profiles
+        """
+        digest = hashlib.sha256(self.population_key().encode())
+        with open(os.path.join(self.data_dir, self.config['home']['wh']['waterdraw_file']), 'rb') as f:
+            digest.update(f.read())
+        return os.path.join(self.outputs_dir, "populations", f"{digest.hexdigest()}.json")
+
+    def write_population(self, file):
+        """
+        Writes the homes to the population cache: the water draw schedules of all
+        homes as one array (.npy, next to file) and the rest of their parameters
+        (but for the HEMS) as json, each home with the index of its draw schedule.
+        :return: None
+        """
+        if not os.path.isdir(os.path.dirname(file)):
+            os.makedirs(os.path.dirname(file))
+        specs = [{
+            **{k: v for k, v in home.items() if k != "hems"},
+            "wh": {**{k: v for k, v in home["wh"].items() if k != "draw_sizes"}, "draw_index": i}
+        } for i, home in enumerate(self.all_homes)]
+        draws = np.array([home["wh"]["draw_sizes"] for home in self.all_homes], dtype=float)
+        for path, write in [(f"{os.path.splitext(file)[0]}.npy", lambda f: np.save(f, draws)), (file, lambda f: f.write(json.dumps(specs).encode()))]:
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                write(f)
+            os.replace(tmp, path) # concurrent runs never read a partial file, the json is written last
+        self.log.logger.info(f"Wrote the homes to the population cache {file}.")
+
+    def read_population(self, file):
+        """
+        Reads the homes from the population cache, with this run's HEMS parameters.
+        The homes only reference their water draw schedules, which are memory mapped
+        by the processes that solve them (see mpc_calc.draw_schedule).
+        :return: None
+        """
+        with open(file) as f:
+            specs = json.load(f)
+        draw_file = os.path.abspath(f"{os.path.splitext(file)[0]}.npy")
+        hems = self.hems_config()
+        self.all_homes = [{**home, "wh": {**home["wh"], "draw_file": draw_file}, "hems": hems} for home in specs]
+        self.log.logger.info(f"Read the homes from the population cache {file}.")
+
+    def hems_config(self):
+        """
+        :return: dictionary of the HEMS parameters given to every home
+        """
+        return {
+            "horizon": self.config['home']['hems']['prediction_horizon'],
+            "hourly_agg_steps": self.dt,
+            "sub_subhourly_steps": self.config['home']['hems']['sub_subhourly_steps'],
+            "solver": self.config['home']['hems']['solver'],
+            "discount_factor": self.config['home']['hems']['discount_factor'],
+            "bid_prices": self.config['home']['hems'].get('bid_prices', []),
+            "cache_size": self.config['home']['hems'].get('cache_size', 0),
+            "cache_policy": self.config['home']['hems'].get('cache_policy', 'lru'),
+            "cache_temp_resolution": self.config['home']['hems'].get('cache_temp_resolution', 0.25),
+            "cache_price_resolution": self.config['home']['hems'].get('cache_price_resolution', 0.005),
+            "cache_draw_resolution": self.config['home']['hems'].get('cache_draw_resolution', 1.0),
+            "cache_param_decimals": self.config['home']['hems'].get('cache_param_decimals', 2),
+            "event_triggered": self.config['home']['hems'].get('event_triggered', False),
+            "event_temp_tol": self.config['home']['hems'].get('event_temp_tol', 0.5),
+            "event_price_tol": self.config['home']['hems'].get('event_price_tol', 0.001),
+            "event_draw_tol": self.config['home']['hems'].get('event_draw_tol', 1.0),
+            "event_max_age": self.config['home']['hems'].get('event_max_age', self.config['home']['hems']['prediction_horizon'] * self.dt - 1),
+            "move_block_lengths": self.config['home']['hems'].get('move_block_lengths', []),
+            "solve_mode": self.config['home']['hems'].get('solve_mode', 'milp'),
+            "template_cache_size": self.config['home']['hems'].get('template_cache_size', 0),
+            "solver_time_limit": self.config['home']['hems'].get('solver_time_limit', 0),
+            "solver_mip_gap": self.config['home']['hems'].get('solver_mip_gap', 0),
+            "forecast_seed": self.config['home']['hems'].get('forecast_seed', 0)
+        }
 
     def create_homes(self):
         """
@@ -378,13 +545,7 @@ class Aggregator:
 
         all_homes = []
 
-        responsive_hems = {
-            "horizon": self.config['home']['hems']['prediction_horizon'],
-            "hourly_agg_steps": self.dt,
-            "sub_subhourly_steps": self.config['home']['hems']['sub_subhourly_steps'],
-            "solver": self.config['home']['hems']['solver'],
-            "discount_factor": self.config['home']['hems']['discount_factor']
-        }
+        responsive_hems = self.hems_config()
 
         if not os.path.isdir(os.path.join('home_logs')):
             os.makedirs('home_logs')
@@ -578,18 +739,84 @@ class Aggregator:
             i += 1
 
         self.all_homes = all_homes
+
+    def set_home_objects(self):
+        """
+        Creates the MPCCalc object of every home in all_homes.
+        :return: None
+        """
         self.all_homes_obj = []
         self.max_poss_load = 0
         self.min_poss_load = 0
-        for home in all_homes:
+        for home in self.all_homes:
             home_obj = MPCCalc(home)
             self.all_homes_obj += [home_obj]
             self.max_poss_load += home_obj.max_load
 
+    def set_archetypes(self):
+        """
+        Sets which homes are solved and how many homes each one stands for. With
+        n_archetypes > 0 only one representative home per archetype is solved and
+        weighted by its archetype size, plus a random sample of
+        archetype_validation_homes (weight 0) solved in full to measure the error.
+        :return: None
+        """
+        n_archetypes = int(self.config['community'].get('n_archetypes', 0))
+        homes = [e for e in self.all_homes if self.check_type == 'all' or e["type"] == self.check_type]
+        if n_archetypes <= 0 or n_archetypes >= len(homes):
+            self.archetypes = None
+            self.validation_homes = []
+            self.home_weights = {home["name"]: 1 for home in homes}
+            return
+
+        self.archetypes = cluster_homes(homes, n_archetypes, seed=self.config['simulation']['random_seed'])
+        self.home_weights = {rep: len(members) for rep, members in self.archetypes.items()}
+        self.representative = {name: rep for rep, members in self.archetypes.items() for name in members}
+
+        n_validation = int(self.config['community'].get('archetype_validation_homes', 0))
+        candidates = sorted(name for name in self.representative if name not in self.home_weights)
+        rng = np.random.default_rng(self.config['simulation']['random_seed'])
+        self.validation_homes = rng.choice(candidates, min(n_validation, len(candidates)), replace=False).tolist()
+        for name in self.validation_homes:
+            self.home_weights[name] = 0
+
+        self.log.logger.info(f"Solving {len(self.archetypes)} archetypes for {len(homes)} homes with {len(self.validation_homes)} validation homes.")
+
+    def get_active_homes(self):
+        """
+        :return: list of MPCCalc objects for the homes solved at each timestep
+        """
+        return [home for home in self.all_homes_obj if home.name in self.home_weights]
+
+    def archetype_error(self):
+        """
+        Compares the validation homes' own trajectories to those of their archetype
+        representatives.
+        :return: dictionary
+        """
+        temp = {"n_archetypes": len(self.archetypes), "n_homes": len(self.representative), "n_validation": len(self.validation_homes)}
+        if len(self.validation_homes) == 0:
+            return temp
+
+        actual = np.array([self.collected_data[name]["p_grid_opt"] for name in self.validation_homes])
+        approx = np.array([self.collected_data[self.representative[name]]["p_grid_opt"] for name in self.validation_homes])
+        temp["home_p_grid_rmse"] = float(np.sqrt(np.mean((approx - actual)**2)))
+        temp["sample_agg_p_grid_rmse"] = float(np.sqrt(np.mean((approx.sum(axis=0) - actual.sum(axis=0))**2)))
+        temp["sample_agg_p_grid_rel_error"] = float(np.sum(np.abs(approx.sum(axis=0) - actual.sum(axis=0))) / max(np.sum(np.abs(actual.sum(axis=0))), 1e-6))
+        temp["sample_energy_rel_error"] = float((approx.sum() - actual.sum()) / max(abs(actual.sum()), 1e-6))
+        return temp
+
     def reset_collected_data(self):
         self.timestep = 0
         self.baseline_agg_load_list = []
+        self.n_dispatched = []
+        self.coordination_log = []
+        self.scheduler = SolveScheduler(self.config['simulation'].get('solve_time_smoothing', 0.3))
+        self.shards = None
+        self.collected_data = {}
         for home in self.all_homes:
+            if not home["name"] in self.home_weights:
+                continue
             self.collected_data[home["name"]] = {
                 "type": home["type"],
                 "temp_in_sp": home["hvac"]["temp_in_sp"],
@@ -606,6 +833,12 @@ class Aggregator:
                 "waterdraws": [],
                 "correct_solve": []
             }
+            if self.config['home']['hems'].get('cache_size', 0) > 0:
+                self.collected_data[home["name"]]["cache_hit"] = []
+            if self.config['home']['hems'].get('event_triggered', False):
+                self.collected_data[home["name"]]["solve_skipped"] = []
+            if self.track_late_solves:
+                self.collected_data[home["name"]]["late_solve"] = []
             if 'pv' in home["type"]:
                 self.collected_data[home["name"]]["p_pv_opt"] = []
                 self.collected_data[home["name"]]["u_pv_curt_opt"] = []
@@ -613,6 +846,20 @@ class Aggregator:
                 self.collected_data[home["name"]]["e_batt_opt"] = [home["battery"]["e_batt_init"]]
                 self.collected_data[home["name"]]["p_batt_ch"] = []
                 self.collected_data[home["name"]]["p_batt_disch"] = []
+        if self.n_shards > 0:
+            self.set_shards()
+
+    def set_shards(self):
+        """
+        Splits the solved homes into n_shards groups of consecutive homes, each
+        reduced by a sub-aggregator in collect_data.
+        :return: None
+        """
+        homes = [(name, self.home_weights[name], [k for k, v in data.items() if isinstance(v, list)]) for name, data in self.collected_data.items()]
+        n = int(np.clip(self.n_shards, 1, len(homes)))
+        bounds = np.linspace(0, len(homes), n + 1).astype(int)
+        self.shards = [Shard(i, homes[bounds[i]:bounds[i+1]], self.bid_prices, self.redis_client.namespace) for i in range(n)]
+        self.history_loaded = {name: 0 for name, _, _ in homes}
 
     def check_all_data_indices(self):
         """
@@ -644,11 +891,11 @@ class Aggregator:
         """
         self.timestep = 0
 
-        self.redis_client.conn.set("start_hour_index", self.start_hour_index)
-        self.redis_client.conn.hset("current_values", "timestep", self.timestep)
+        self.redis_client.conn.set(self.redis_client.key("start_hour_index"), self.start_hour_index)
+        self.redis_client.conn.hset(self.redis_client.key("current_values"), "timestep", self.timestep)
 
         self.reward_price = np.zeros(self.config['agg']['rl']['action_horizon'] * self.dt)
-        self.redis_client.conn.rpush("reward_price", *self.reward_price.tolist())
+        self.redis_client.conn.rpush(self.redis_client.key("reward_price"), *self.reward_price.tolist())
 
     def redis_add_all_data(self):
         """
@@ -658,21 +905,21 @@ class Aggregator:
         :return: None
         """
         for c in self.all_data.columns.to_list():
-            self.redis_client.conn.delete(c)
-            self.redis_client.conn.rpush(c, *self.all_data[c].values.tolist())
+            self.redis_client.conn.delete(self.redis_client.key(c))
+            self.redis_client.conn.rpush(self.redis_client.key(c), *self.all_data[c].values.tolist())
 
     def redis_set_current_values(self):
         """
         Sets the current values of the utility agent (reward price).
         :return: None
         """
-        self.redis_client.conn.hset("current_values", "timestep", self.timestep)
+        self.redis_client.conn.hset(self.redis_client.key("current_values"), "timestep", self.timestep)
 
         if 'rl' in self.case:
             self.all_sps[self.timestep] = self.agg_setpoint
             self.all_rps[self.timestep] = self.reward_price[0]
-            self.redis_client.conn.delete("reward_price")
-            self.redis_client.conn.rpush("reward_price", *self.reward_price)
+            self.redis_client.conn.delete(self.redis_client.key("reward_price"))
+            self.redis_client.conn.rpush(self.redis_client.key("reward_price"), *self.reward_price)
 
     def gen_setpoint(self):
         """
@@ -711,7 +958,7 @@ class Aggregator:
     def run_iteration(self):
         """
         Calls the MPCCalc class to calculate the control sequence and power demand
-        from all homes in the community. Threaded, using pathos
+        from all homes in the community, using the configured executor
         :return: None
         """
         self.thermal_trend = self.oat[self.timestep + 4] - self.oat[self.timestep]
@@ -720,62 +967,299 @@ class Aggregator:
         self.min_daily_temp = min(self.oat[day_of_year*(self.dt*24):(day_of_year+1)*(self.dt*24)])
         self.max_daily_ghi = max(self.ghi[day_of_year*(self.dt*24):(day_of_year+1)*(self.dt*24)])
 
-        pool = ProcessPool(nodes=self.config['simulation']['n_nodes']) # open a pool of nodes
-        results = pool.map(manage_home, self.as_list)
+        due = self.due_homes()
+        if self.load_balancing:
+            due = self.scheduler.order(due)
+        start = time.time()
+        if self.timestep_budget > 0:
+            self.redis_client.conn.hset(self.redis_client.key("current_values"), "deadline", start + self.timestep_budget)
+        due_names = set(home.name for home in due)
+        planned = []
+        for home in self.as_list:
+            if not home.name in due_names: # executes its stored plan, no solve needed
+                plan_home = copy(home) # keeps the solver state of the original out of later dispatches
+                plan_home.resolve_due = False
+                planned.append(plan_home)
+        results, failed = self.executor.map(manage_home, due + planned, name=lambda home: home.name)
+        for home in failed: # runs the fallback controller, without a solve
+            fallback_home = copy(home)
+            fallback_home.fallback_only = True
+            try:
+                manage_home(fallback_home)
+            except Exception as e:
+                self.log.logger.error(f"Fallback controller failed for {home.name}: {e}")
+        self.scheduler.update(due, results[:len(due)], time.time() - start, self.config['simulation']['n_nodes'])
+        self.n_dispatched.append(len(due))
+        if self.timestep_budget > 0 and time.time() - start > self.timestep_budget:
+            self.log.logger.warning(f"Timestep {self.timestep} took {time.time() - start:.2f} s, over the budget of {self.timestep_budget} s.")
+
+        self.timestep += 1
+
+    def coordinate_prices(self):
+        """
+        Dual decomposition of a community peak constraint, sum of the home grid
+        loads <= peak_limit at every step of the horizon. Each iteration every
+        home solves its MPC at the current prices (without implementing it) and
+        the price of each step rises with the community's violation of the limit,
+        lambda = max(0, lambda + step_size / sqrt(k) * (load - limit)). Iterates
+        from zero prices until the proposals meet the limit (within tolerance) or
+        max_iterations, and leaves the prices of the best iterate, on top of the
+        aggregator's own reward price, in the redis reward_price for run_iteration.
+        :return: None
+        """
+        limit = self.coordination.get('peak_limit', 0)
+        if limit <= 0: # follow the setpoint of the previous timestep
+            if self.timestep == 0:
+                return
+            limit = self.agg_setpoint
+        step_size = self.coordination.get('step_size', 0.001)
+        tolerance = self.coordination.get('tolerance', 0.1)
+
+        start = time.time()
+        base = np.zeros(self.horizon)
+        rp = np.array(self.reward_price, dtype=float)[:self.horizon]
+        base[:len(rp)] = rp
+        prices = np.zeros(self.horizon)
+        best = (np.inf, prices)
+        homes = self.scheduler.order(self.as_list) if self.load_balancing else self.as_list
+        for k in range(1, max(1, self.coordination.get('max_iterations', 10)) + 1):
+            self.redis_client.conn.delete(self.redis_client.key("reward_price"))
+            self.redis_client.conn.rpush(self.redis_client.key("reward_price"), *(base + prices).tolist())
+            if self.timestep_budget > 0:
+                self.redis_client.conn.hset(self.redis_client.key("current_values"), "deadline", time.time() + self.timestep_budget)
+            results, failed = self.executor.map(propose_home, homes, name=lambda home: home.name)
+            proposals = {} # only this iteration's proposals, a home failing now does not keep an earlier one
+            for r in results:
+                if r is not None and r["p_grid"] is not None:
+                    proposals[r["name"]] = np.array(r["p_grid"])
+            for home in homes: # homes that failed keep their current load
+                if not home.name in proposals:
+                    proposals[home.name] = float(self.redis_client.conn.hget(self.redis_client.key(home.name), "p_grid_opt") or 0) * np.ones(self.horizon)
+            load = np.sum([self.home_weights[name] * p for name, p in proposals.items()], axis=0)
+            residual = float(max(0, np.max(load - limit)))
+            if residual < best[0]:
+                best = (residual, prices)
+            if residual <= tolerance:
+                break
+            prices = np.maximum(0, prices + step_size / np.sqrt(k) * (load - limit))
+
+        residual, prices = best
+        self.redis_client.conn.delete(self.redis_client.key("reward_price"))
+        self.redis_client.conn.rpush(self.redis_client.key("reward_price"), *(base + prices).tolist())
+        self.all_rps[self.timestep] = base[0] + prices[0]
+        self.coordination_log.append({
+            "timestep": self.timestep,
+            "iterations": k,
+            "residual": residual,
+            "converged": residual <= tolerance,
+            "price": float(prices[0]),
+            "wall_time": time.time() - start
+        })
+        self.log.logger.info(f"Coordinated timestep {self.timestep} in {k} iterations, peak violation {residual:.3f} kW, price {prices[0]:.4f}.")
+
+    def due_homes(self):
+        """
+        With resolve_every = k > 1 each home solves once every k timesteps and
+        executes its latest plan in between. Homes are staggered by their position
+        in the active list so about 1/k of them solve at each timestep.
+        :return: list of MPCCalc objects to solve at this timestep
+        """
+        k = self.resolve_every
+        if k <= 1 or self.timestep == 0:
+            return self.as_list
+        return [home for i, home in enumerate(self.as_list) if (self.timestep - i) % k == 0]
+
+    def setup_surrogate(self):
+        """
+        Trains the surrogate model of the community load response from the
+        results files listed in [agg.surrogate] (relative to the outputs directory),
+        recorded by other runs. The surrogate run writes its own results to the
+        "surrogate" case of the run directory.
+        :return: None
+        """
+        surrogate_config = self.config['agg'].get('surrogate', {})
+        if not surrogate_config.get('enabled', False):
+            self.surrogate = None
+            return
 
+        files = [os.path.join(self.outputs_dir, f) for f in surrogate_config.get('training_files', [])]
+        if len(files) == 0:
+            self.log.logger.error("The surrogate needs the training_files of a reference run in [agg.surrogate].")
+            sys.exit(1)
+        own_results = os.path.abspath(os.path.join(self.run_dir, "surrogate", "results.json"))
+        if any(os.path.abspath(f) == own_results for f in files):
+            self.log.logger.error(f"The surrogate cannot train on the results it writes, {own_results}.")
+            sys.exit(1)
+        self.surrogate = LoadSurrogate(self.config, self.dt)
+        self.surrogate.fit_files(files)
+
+    def surrogate_features(self):
+        """
+        Surrogate model inputs for the current timestep.
+        :return: numpy.ndarray
+        """
+        price_key = "SPP" if self.config['agg']['spp_enabled'] else "tou"
+        env = self.all_data.loc[self.mask]
+        t = min(self.timestep, len(env.index) - 1)
+        hour = self.start_dt.hour + self.timestep / self.dt
+        return self.surrogate.features(float(self.reward_price[0]), env["OAT"].values[t], env["GHI"].values[t], env[price_key].values[t], hour, self.baseline_agg_load_list)
+
+    def surrogate_iteration(self, x):
+        """
+        Stands in for run_iteration and collect_data using the surrogate model's
+        prediction of the aggregate load. Home states are not advanced.
+        :return: None
+        """
+        self.agg_load = self.surrogate.predict(x)
+        self.forecast_load = self.agg_load
+        self.agg_cost = self.agg_load * (x[3] + x[0])
+        self.baseline_agg_load_list.append(self.agg_load)
         self.timestep += 1
+        self.agg_setpoint = self.gen_setpoint()
+
+    def step_community(self):
+        """
+        Advances the community by one timestep. With the surrogate enabled the
+        real MPC community is only run on resync timesteps (and until the surrogate
+        has been trained), and every real timestep is fed back to the surrogate.
+        :return: None
+        """
+        if self.surrogate is None:
+            if self.coordination.get('enabled', False):
+                self.coordinate_prices()
+            self.run_iteration()
+            self.collect_data()
+            return
+
+        x = self.surrogate_features()
+        if self.surrogate.due_for_resync(self.timestep):
+            self.run_iteration()
+            self.collect_data()
+            self.surrogate.observe(x, self.agg_load)
+        else:
+            self.surrogate_iteration(x)
 
     def collect_data(self):
         """
         Collects the data passed by the community redis connection.
         :return: None
         """
+        if self.shards is not None:
+            self.collect_shard_data()
+            return
+
         agg_load = 0
         agg_cost = 0
         self.house_load = []
         self.forecast_house_load = []
+        bid_loads = []
         for home in self.all_homes:
-            if self.check_type == 'all' or home["type"] == self.check_type:
-                vals = self.redis_client.conn.hgetall(home["name"])
+            if home["name"] in self.home_weights:
+                weight = self.home_weights[home["name"]]
+                vals = self.redis_client.conn.hgetall(self.redis_client.key(home["name"]))
                 for k, v in vals.items():
                     opt_keys = ["p_grid_opt", "forecast_p_grid_opt", "p_load_opt", "temp_in_opt", "temp_wh_opt", "hvac_cool_on_opt", "hvac_heat_on_opt", "wh_heat_on_opt", "cost_opt", "waterdraws", "correct_solve"]
                     if 'pv' in home["type"]:
                         opt_keys += ['p_pv_opt','u_pv_curt_opt']
                     if 'battery' in home["type"]:
                         opt_keys += ['p_batt_ch', 'p_batt_disch', 'e_batt_opt']
+                    if 'cache_hit' in self.collected_data[home["name"]]:
+                        opt_keys += ['cache_hit']
+                    if 'solve_skipped' in self.collected_data[home["name"]]:
+                        opt_keys += ['solve_skipped']
+                    if 'late_solve' in self.collected_data[home["name"]]:
+                        opt_keys += ['late_solve']
                     if k in opt_keys:
                         self.collected_data[home["name"]][k].append(float(v))
-                self.house_load.append(float(vals["p_grid_opt"]))
-                self.forecast_house_load.append(float(vals["forecast_p_grid_opt"]))
-                agg_cost += float(vals["cost_opt"])
+                self.house_load.append(weight * float(vals["p_grid_opt"]))
+                self.forecast_house_load.append(weight * float(vals["forecast_p_grid_opt"]))
+                agg_cost += weight * float(vals["cost_opt"])
+                if len(self.bid_prices) > 0:
+                    bid_loads.append(weight * self.parse_bid_curve(vals))
         self.agg_load = np.sum(self.house_load)
         self.forecast_load = np.sum(self.forecast_house_load)
         self.agg_cost = agg_cost
+        if len(self.bid_prices) > 0:
+            self.bid_curve = np.sum(bid_loads, axis=0)
+        self.baseline_agg_load_list.append(self.agg_load)
+        self.agg_setpoint = self.gen_setpoint()
+
+    def collect_shard_data(self):
+        """
+        Hierarchical collect_data. The shards are reduced by the executor's workers
+        and only their partial aggregates are summed here. The homes' values are
+        kept in redis until load_shard_history.
+        :return: None
+        """
+        partials, failed = self.executor.map(reduce_shard, self.shards, name=lambda shard: f"shard {shard.id}")
+        partials = [p for p in partials if p is not None] + [reduce_shard(shard) for shard in failed]
+        self.agg_load = sum(p["p_grid_opt"] for p in partials)
+        self.forecast_load = sum(p["forecast_p_grid_opt"] for p in partials)
+        self.agg_cost = sum(p["cost_opt"] for p in partials)
+        if len(self.bid_prices) > 0:
+            self.bid_curve = np.sum([p["bid_curve"] for p in partials], axis=0)
+        failed_solves = sum(p["failed_solves"] for p in partials)
+        if failed_solves > 0:
+            self.log.logger.warning(f"{failed_solves} homes fell back at timestep {self.timestep - 1}.")
         self.baseline_agg_load_list.append(self.agg_load)
         self.agg_setpoint = self.gen_setpoint()
 
-    def run_baseline(self):
+    def load_shard_history(self):
+        """
+        Appends the home values posted by the shards since the last call to
+        collected_data.
+        :return: None
+        """
+        names = list(self.history_loaded.keys())
+        pipe = self.redis_client.conn.pipeline(transaction=False)
+        for name in names:
+            pipe.lrange(self.redis_client.key(f"{name}:history"), self.history_loaded[name], -1)
+        for name, entries in zip(names, pipe.execute()):
+            for entry in entries:
+                for k, v in json.loads(entry).items():
+                    self.collected_data[name][k].append(v)
+            self.history_loaded[name] += len(entries)
+
+    def parse_bid_curve(self, vals):
+        """
+        :return: numpy.ndarray, load at each of the bid_prices
+        """
+        return parse_bid_curve(vals, self.bid_prices)
+
+    def community_response(self, reward_price):
+        """
+        Estimates the aggregate load for a candidate reward price by interpolating
+        the sum of the homes' bid curves from the last timestep, without another
+        round of home solves.
+        :param reward_price: float or numpy.ndarray of candidate reward prices
+        :return: float or numpy.ndarray, aggregate load (kW)
+        """
+        if self.bid_curve is None:
+            self.log.logger.error("No bid curves collected. Set bid_prices in [home.hems].")
+            return None
+        order = np.argsort(self.bid_prices)
+        return np.interp(reward_price, self.bid_prices[order], self.bid_curve[order])
+
+    def run_baseline(self, stop=None):
         """
         Runs the baseline simulation comprised of community of HEMS controlled homes.
         Utilizes MPC parameters specified in config file.
         (For no MPC in HEMS specify the MPC prediction horizon as 0.)
+        :param stop: int, timestep at which to stop, None to run to the end
         :return: None
         """
         self.log.logger.info(f"Performing baseline run for horizon: {self.config['home']['hems']['prediction_horizon']}")
-        self.start_time = datetime.now()
+        self.start_time = datetime.now() - timedelta(seconds=self.resumed_run_time)
 
-        self.as_list = []
-        for home in self.all_homes_obj:
-            if self.check_type == "all" or home.type == self.check_type:
-                self.as_list += [home]
-        for t in range(self.num_timesteps):
+        self.as_list = self.get_active_homes()
+        for t in range(self.timestep, self.num_timesteps if stop is None else stop):
             self.redis_set_current_values()
-            self.run_iteration()
-            self.collect_data()
+            self.step_community()
 
             if (t+1) % (self.checkpoint_interval) == 0: # weekly checkpoint
                 self.log.logger.info("Creating a checkpoint file.")
                 self.write_outputs()
+                self.write_checkpoint()
 
     def my_summary(self):
         return
@@ -808,6 +1292,48 @@ class Aggregator:
             # "rl_rewards": self.all_rewards
         }
 
+        if self.surrogate is not None:
+            self.collected_data["Summary"]["surrogate"] = self.surrogate.summary()
+
+        if self.archetypes is not None:
+            self.collected_data["Summary"]["archetypes"] = self.archetype_error()
+
+        if self.config['home']['hems'].get('cache_size', 0) > 0:
+            self.collected_data["Summary"]["solution_cache"] = self.summarize_solution_cache()
+
+        self.collected_data["Summary"]["workers"] = self.executor.summary()
+
+        self.collected_data["Summary"]["load_balance"] = self.scheduler.summary()
+
+        if self.shards is not None:
+            self.collected_data["Summary"]["shards"] = {
+                "n_shards": len(self.shards),
+                "max_homes_per_shard": max(len(shard.homes) for shard in self.shards)
+            }
+
+        if self.track_late_solves:
+            self.collected_data["Summary"]["late_solves"] = int(sum(sum(v["late_solve"]) for k, v in self.collected_data.items() if "late_solve" in v))
+
+        if len(self.coordination_log) > 0:
+            self.collected_data["Summary"]["coordination"] = {
+                "n_homes": len(self.as_list),
+                "mean_iterations": float(np.mean([c["iterations"] for c in self.coordination_log])),
+                "max_iterations": int(max(c["iterations"] for c in self.coordination_log)),
+                "converged_fraction": float(np.mean([c["converged"] for c in self.coordination_log])),
+                "mean_wall_time": float(np.mean([c["wall_time"] for c in self.coordination_log])),
+                "timesteps": self.coordination_log
+            }
+
+        if self.resolve_every > 1:
+            self.collected_data["Summary"]["resolve_every"] = {
+                "k": self.resolve_every,
+                "mean_solves_per_step": float(np.mean(self.n_dispatched[1:])) if len(self.n_dispatched) > 1 else 0.0,
+                "max_solves_per_step": int(max(self.n_dispatched[1:])) if len(self.n_dispatched) > 1 else 0
+            }
+
+        if self.config['home']['hems'].get('event_triggered', False):
+            self.collected_data["Summary"]["event_triggered"] = self.summarize_event_triggered()
+
         self.my_summary()
 
         if self.config['agg']['spp_enabled']:
@@ -815,6 +1341,46 @@ class Aggregator:
         else:
             self.collected_data["Summary"]["TOU"] = self.all_data.loc[self.mask, "tou"].values.tolist(),
 
+    def summarize_solution_cache(self):
+        """
+        Totals the MPC solution cache metrics posted by each worker process.
+        :return: dictionary
+        """
+        all_stats = [json.loads(v) for v in self.redis_client.conn.hgetall(self.redis_client.key("solution_cache")).values()]
+        temp = {k: sum(stats[k] for stats in all_stats) for k in ["hits", "misses", "rejected", "evictions", "entries", "nbytes"]}
+        temp["hit_rate"] = temp["hits"] / max(1, temp["hits"] + temp["misses"])
+        temp["n_processes"] = len(all_stats)
+        self.log.logger.info(f"MPC solution cache: {temp}")
+        return temp
+
+    def summarize_event_triggered(self):
+        """
+        Fraction of home timesteps that executed a stored plan instead of solving,
+        with the community cost and comfort violation (degree-timesteps outside the
+        indoor temperature band) for comparison against a run that solves every step.
+        :return: dictionary
+        """
+        skipped = []
+        total_cost = 0
+        violation = 0
+        for home in self.all_homes:
+            if not home["name"] in self.home_weights:
+                continue
+            weight = self.home_weights[home["name"]]
+            data = self.collected_data[home["name"]]
+            skipped += data["solve_skipped"]
+            total_cost += weight * sum(data["cost_opt"])
+            temp_in = np.array(data["temp_in_opt"][1:])
+            violation += weight * float(np.sum(np.maximum(0, temp_in - home["hvac"]["temp_in_max"]) + np.maximum(0, home["hvac"]["temp_in_min"] - temp_in)))
+        temp = {
+            "skipped_fraction": float(np.mean(skipped)) if len(skipped) > 0 else 0.0,
+            "n_solves": int(len(skipped) - np.sum(skipped)),
+            "total_cost": total_cost,
+            "comfort_violation": violation
+        }
+        self.log.logger.info(f"Event triggered MPC: {temp}")
+        return temp
+
     def set_run_dir(self):
         """
         Sets the run directoy based on the start/end datetime, community and home configs,
@@ -834,6 +1400,8 @@ class Aggregator:
         called at the end of the simulation run period and optionally at a checkpoint period.
         :return: None
         """
+        if self.shards is not None:
+            self.load_shard_history()
         self.summarize_baseline()
 
         case_dir = os.path.join(self.run_dir, self.case)
@@ -843,6 +1411,104 @@ class Aggregator:
         with open(file, 'w+') as f:
             json.dump(self.collected_data, f, indent=4)
 
+    def write_checkpoint(self, file=None):
+        """
+        Writes the state needed to continue the run from the current timestep to
+        checkpoint.pkl in the case directory: the aggregator attributes of
+        CHECKPOINT_ATTRIBUTES, the random states and each home's redis values
+        (its last optimal values, stored plan and solve counter).
+        :param file: str, path of the checkpoint, None for checkpoint.pkl
+        :return: None
+        """
+        names = list(self.home_weights.keys())
+        pipe = self.redis_client.conn.pipeline(transaction=False)
+        for name in names:
+            pipe.hgetall(self.redis_client.key(name))
+            pipe.lrange(self.redis_client.key(f"{name}:history"), 0, -1)
+        pipe.hgetall(self.redis_client.key("current_values"))
+        pipe.lrange(self.redis_client.key("reward_price"), 0, -1)
+        pipe.hgetall(self.redis_client.key("solution_cache"))
+        vals = pipe.execute()
+
+        state = {
+            "config": self.config,
+            "population_key": self.population_key(),
+            "run_time": (datetime.now() - self.start_time).total_seconds(),
+            "aggregator": {k: getattr(self, k) for k in CHECKPOINT_ATTRIBUTES if hasattr(self, k)},
+            "np_random": np.random.get_state(),
+            "random": random.getstate(),
+            "homes": {name: {"vals": vals[2*i], "history": vals[2*i+1]} for i, name in enumerate(names)},
+            "current_values": vals[-3],
+            "reward_price": vals[-2],
+            "solution_cache": vals[-1]
+        }
+        if file is None:
+            file = os.path.join(self.run_dir, self.case, "checkpoint.pkl")
+        if not os.path.isdir(os.path.dirname(file)):
+            os.makedirs(os.path.dirname(file))
+        with open(file + ".tmp", 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(file + ".tmp", file) # a crash while writing leaves the previous checkpoint
+
+    def load_checkpoint(self, file=None, branch=False):
+        """
+        Restores the state written by write_checkpoint, once the homes are set up
+        (after reset_collected_data), so that run_baseline continues from the
+        checkpoint's timestep.
+        :param file: str, path of the checkpoint, None for checkpoint.pkl
+        :param branch: bool, continues a snapshot of run_prefix with this config,
+        which may differ from the snapshot's but for the home population
+        :return: bool, False if there is no checkpoint
+        """
+        if file is None:
+            file = os.path.join(self.run_dir, self.case, "checkpoint.pkl")
+        if not os.path.isfile(file):
+            if branch:
+                self.log.logger.error(f"Snapshot {file} does not exist.")
+                sys.exit(1)
+            self.log.logger.warning(f"No checkpoint in {os.path.dirname(file)}, starting from timestep 0.")
+            return False
+        with open(file, 'rb') as f:
+            state = pickle.load(f)
+        if branch and state["population_key"] != self.population_key():
+            self.log.logger.error(f"The snapshot {file} is of a different home population, a branch can only change pricing, aggregator and HEMS parameters.")
+            sys.exit(1)
+        elif not branch and state["config"] != self.config:
+            self.log.logger.error(f"The checkpoint {file} was written with a different config, it cannot be resumed.")
+            sys.exit(1)
+
+        reset_data = self.collected_data
+        for k, v in state["aggregator"].items():
+            if branch and k in BRANCH_OWN_ATTRIBUTES: # e.g. the snapshot's shard history is already in collected_data
+                continue
+            setattr(self, k, v)
+        if branch: # metrics this config collects and the prefix did not (e.g. solve_skipped), zero over the prefix
+            for name, vals in reset_data.items():
+                for k, v in vals.items():
+                    if isinstance(v, list) and not k in self.collected_data[name]:
+                        self.collected_data[name][k] = [0.0] * len(self.collected_data[name]["p_grid_opt"])
+        np.random.set_state(state["np_random"])
+        random.setstate(state["random"])
+
+        pipe = self.redis_client.conn.pipeline(transaction=False)
+        for name, home_state in state["homes"].items():
+            pipe.delete(self.redis_client.key(name), self.redis_client.key(f"{name}:history"))
+            if len(home_state["vals"]) > 0:
+                pipe.hset(self.redis_client.key(name), mapping=home_state["vals"])
+            if len(home_state["history"]) > 0 and not branch:
+                pipe.rpush(self.redis_client.key(f"{name}:history"), *home_state["history"])
+        for key in ["current_values", "solution_cache"]:
+            pipe.delete(self.redis_client.key(key))
+            if len(state[key]) > 0:
+                pipe.hset(self.redis_client.key(key), mapping=state[key])
+        pipe.delete(self.redis_client.key("reward_price"))
+        pipe.rpush(self.redis_client.key("reward_price"), *state["reward_price"])
+        pipe.execute()
+
+        self.resumed_run_time = state["run_time"]
+        self.log.logger.info(f"Resuming from the {'snapshot' if branch else 'checkpoint'} at timestep {self.timestep}.")
+        return True
+
     def write_home_configs(self):
         """
         Writes all home configurations to file at the initialization of the
@@ -876,10 +1542,7 @@ class Aggregator:
     def setup_rl_agg_run(self):
         self.flush_redis()
 
-        self.as_list = []
-        for home in self.all_homes_obj:
-            if self.check_type == "all" or home["type"] == self.check_type:
-                self.as_list += [home]
+        self.as_list = self.get_active_homes()
 
         # self.log.logger.info(f"Performing RL AGG (agg. horizon: {self.util['rl_agg_horizon']}, learning rate: {self.rl_params['alpha']}, discount factor: {self.rl_params['beta']}, exploration rate: {self.rl_params['epsilon']}) with MPC HEMS for horizon: {self.config['home']['hems']['prediction_horizon']}")
         self.start_time = datetime.now()
@@ -910,13 +1573,42 @@ class Aggregator:
         self.log.logger.info(f"Iteration {self.timestep} finished. Aggregate load {self.agg_load}")
         self.timestep += 1
 
+    def run_rl_sweep(self):
+        """
+        Trains every combination of the RL hyperparameters listed in [agg.rl.sweep]
+        against the simplified community response model and writes a ranked table
+        of the agents to the run directory.
+        :return: None
+        """
+        sweep = RLSweep(self.config, self.dt)
+        sweep.run()
+        sweep.write_results(os.path.join(self.run_dir, "rl_sweep"))
+
+    def run_benchmark(self):
+        """
+        Times the home MPC solves for each case in [benchmark.cases] (overrides of
+        [home.hems]) against the exact MILP with one move per timestep, solved by GLPK_MI.
+        :return: None
+        """
+        bench_config = self.config.get('benchmark', {})
+        self.flush_redis()
+        self.get_homes()
+        homes = self.all_homes[:int(bench_config.get('n_homes', len(self.all_homes)))]
+        timesteps = [t for t in bench_config.get('timesteps', [0]) if t < self.num_timesteps]
+
+        cases = {"milp": {"solve_mode": "milp", "solver": "GLPK_MI", "move_block_lengths": []}}
+        cases.update(bench_config.get('cases', {}))
+        benchmark = SolveBenchmark(homes, timesteps)
+        benchmark.run(cases)
+        benchmark.write_results(os.path.join(self.run_dir, "benchmark"))
+
     def flush_redis(self):
         """
-        Cleans all information stored in the Redis server. (Including environmental
-        and home data.)
+        Cleans all information of this simulation stored in the Redis server.
+        (Including environmental and home data.)
         :return: None
         """
-        self.redis_client.conn.flushall()
+        self.redis_client.flush()
         self.log.logger.info("Flushing Redis")
         time.sleep(1)
         self.check_all_data_indices()
@@ -938,14 +1630,11 @@ class Aggregator:
     #     keys, values = zip(*util_parameters.items())
     #     self.util_permutations = [dict(zip(keys, v)) for v in it.product(*values)]
 
-    def run(self):
+    def setup_run(self):
         """
-        Runs simulation(s) specified in the config file with all combinations of
-        parameters specified in the config file.
+        Sets the checkpoint interval, run directory and surrogate of a run.
         :return: None
         """
-        self.log.logger.info("Made it to Aggregator Run")
-
         self.checkpoint_interval = 500 # default to checkpoints every 1000 timesteps
         if self.config['simulation']['checkpoint_interval'] == 'hourly':
             self.checkpoint_interval = self.dt
@@ -956,15 +1645,57 @@ class Aggregator:
 
         self.version = self.config['simulation']['named_version']
         self.set_run_dir()
+        self.setup_surrogate()
+
+    def run_prefix(self, timestep, file):
+        """
+        Runs the baseline up to timestep and writes the community state there to
+        file, the snapshot from which each branch of a ScenarioBranches continues.
+        :return: None
+        """
+        self.log.logger.info(f"Running the shared prefix up to timestep {timestep}")
+        self.setup_run()
+        self.case = "baseline"
+        self.flush_redis()
+        self.get_homes()
+        self.set_archetypes()
+        self.reset_collected_data()
+        self.run_baseline(stop=timestep)
+        if self.shards is not None:
+            self.load_shard_history()
+        self.write_checkpoint(file)
+
+    def run(self, resume=False, branch_from=None):
+        """
+        Runs simulation(s) specified in the config file with all combinations of
+        parameters specified in the config file.
+        :param resume: bool, continues the baseline run from its latest checkpoint
+        :param branch_from: str, snapshot written by run_prefix to continue the
+        baseline run from
+        :return: None
+        """
+        self.log.logger.info("Made it to Aggregator Run")
+        self.setup_run()
 
         if self.config['simulation']['run_rbo_mpc']:
             # Run baseline MPC with N hour horizon, no aggregator
             # Run baseline with 1 hour horizon for non-MPC HEMS
-            self.case = "baseline" # no aggregator level control
+            self.case = "baseline" if self.surrogate is None else "surrogate" # no aggregator level control
             # for self.mpc in self.mpc_permutations:
             # for self.version in self.versions:
             self.flush_redis()
             self.get_homes()
+            self.set_archetypes()
             self.reset_collected_data()
+            if branch_from is not None:
+                self.load_checkpoint(branch_from, branch=True)
+            elif resume:
+                self.load_checkpoint()
             self.run_baseline()
             self.write_outputs()
+
+        if self.config['simulation'].get('run_rl_sweep', False):
+            self.run_rl_sweep()
+
+        if self.config['simulation'].get('run_benchmark', False):
+            self.run_benchmark()
@@ -0,0 +1,61 @@
+import numpy as np
+from scipy.cluster.vq import kmeans2
+
+# Local
+from dragg.mpc_calc import draw_schedule
+
+def home_features(home):
+    """
+    Numeric parameters of a home used to group it with similar homes.
+    :param home: Dictionary of home parameters as generated by Aggregator.create_homes
+    :return: numpy.ndarray
+    """
+    features = []
+    for subsystem in ["hvac", "wh", "battery", "pv"]:
+        if subsystem in home:
+            for k in sorted(home[subsystem].keys()):
+                v = home[subsystem][k]
+                if k in ["draw_sizes", "draw_index"]:
+                    features.append(float(np.mean(draw_schedule(home[subsystem])))) # average hourly draw
+                elif k == "draw_file":
+                    continue
+                elif isinstance(v, (int, float)):
+                    features.append(float(v))
+    return np.array(features)
+
+def cluster_homes(all_homes, n_archetypes, seed=None):
+    """
+    Groups homes of the same type into archetypes by k-means on their standardized
+    parameters. Archetypes are shared out between home types in proportion to the
+    number of homes of each type (at least one per type). Each archetype is
+    represented by the member home closest to the cluster centroid.
+    :param all_homes: list of home dictionaries
+    :param n_archetypes: int, total number of archetypes
+    :return: dictionary, representative home name: list of member home names
+    """
+    archetypes = {}
+    types = sorted(set(home["type"] for home in all_homes))
+    for home_type in types:
+        homes = [home for home in all_homes if home["type"] == home_type]
+        k = int(np.clip(round(n_archetypes * len(homes) / len(all_homes)), 1, len(homes)))
+
+        x = np.array([home_features(home) for home in homes])
+        std = x.std(axis=0)
+        std[std == 0] = 1
+        x = (x - x.mean(axis=0)) / std
+
+        if k == len(homes):
+            labels = np.arange(len(homes))
+            centroids = x
+        else:
+            centroids, labels = kmeans2(x, k, minit='++', seed=seed)
+
+        for c in range(len(centroids)):
+            members = np.flatnonzero(labels == c)
+            if len(members) == 0:
+                continue
+            dist = np.linalg.norm(x[members] - centroids[c], axis=1)
+            rep = homes[members[np.argmin(dist)]]["name"]
+            archetypes[rep] = [homes[i]["name"] for i in members]
+
+    return archetypes
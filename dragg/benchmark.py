@@ -0,0 +1,144 @@
+import os
+import json
+import time
+from copy import deepcopy
+import numpy as np
+from prettytable import PrettyTable
+
+# Local
+from dragg.mpc_calc import MPCCalc
+from dragg.logger import Logger
+
+class SolveBenchmark:
+    """
+    Times single home MPC solves under alternative [home.hems] settings, each
+    from the same initial conditions and inputs, and compares them against the
+    settings in the config file. Requires the environment data to be loaded in
+    redis (see Aggregator.flush_redis).
+    """
+    def __init__(self, homes, timesteps):
+        """
+        :param homes: list of home dictionaries as generated by Aggregator.create_homes
+        :param timesteps: list of int, timesteps at which every home is solved
+        """
+        self.log = Logger("benchmark")
+        self.homes = homes
+        self.timesteps = timesteps
+        self.results = {}
+
+    def initial_values(self, home):
+        """
+        Stands in for the values a home would have stored at the previous timestep,
+        so that every case starts from the home's initial conditions.
+        :return: dictionary
+        """
+        vals = {
+            "temp_in_opt": home["hvac"]["temp_in_init"],
+            "temp_wh_opt": home["wh"]["temp_wh_init"],
+            "solve_counter": 0
+        }
+        if 'battery' in home["type"]:
+            vals["e_batt_opt"] = home["battery"]["e_batt_init"] * home["battery"]["capacity"]
+            vals["p_batt_ch"] = 0
+            vals["p_batt_disch"] = 0
+        return vals
+
+    def solve(self, home, hems, timestep):
+        """
+        Builds and solves one home's MPC problem.
+        :param hems: dictionary of [home.hems] values overriding the home's own
+        :return: MPCCalc, float wall time of the setup and solve (s)
+        """
+        home = deepcopy(home)
+        home["hems"].update({"cache_size": 0, "event_triggered": False, "bid_prices": []})
+        home["hems"].update(hems)
+
+        mpc = MPCCalc(home)
+        mpc.log = self.log.logger
+        mpc.timestep = timestep
+        mpc.prev_optimal_vals = self.initial_values(home)
+
+        start = time.time()
+        mpc.get_initial_conditions()
+        mpc.solve_type_problem()
+        return mpc, time.time() - start
+
+    def run(self, cases):
+        """
+        :param cases: dictionary, case name: dictionary of [home.hems] overrides.
+        The first case is the reference for the speedup and cost gap.
+        :return: None
+        """
+        for name, hems in cases.items():
+            self.log.logger.info(f"Benchmarking {name}: {hems}")
+            records = []
+            for t in self.timesteps:
+                for home in self.homes:
+                    mpc, wall_time = self.solve(home, hems, t)
+                    records.append({
+                        "home": home["name"],
+                        "timestep": t,
+                        "status": mpc.status,
+                        "wall_time": wall_time,
+                        "n_variables": int(sum(v.size for v in mpc.prob.variables())) if mpc.prob is not None else 0,
+                        "n_integer": int(sum(v.size for v in mpc.prob.variables() if v.attributes['integer'])) if mpc.prob is not None else 0,
+                        "cost": float(np.sum(mpc.solution["cost"])) if mpc.status == 'optimal' else None,
+                        "comfort_violation": self.comfort_violation(mpc) if mpc.status == 'optimal' else None
+                    })
+            self.results[name] = records
+
+    def comfort_violation(self, mpc):
+        """
+        Degree-timesteps outside the indoor and water heater temperature bands over
+        the plan (nonzero only for plans that are not solved exactly).
+        :return: float
+        """
+        temp_in = mpc.solution["temp_in_ev"][1:]
+        temp_wh = mpc.solution["temp_wh_ev"][1:]
+        return float(np.sum(np.maximum(0, temp_in - mpc.temp_in_max.value) + np.maximum(0, mpc.temp_in_min.value - temp_in))
+                    + np.sum(np.maximum(0, temp_wh - mpc.temp_wh_max.value) + np.maximum(0, mpc.temp_wh_min.value - temp_wh)))
+
+    def summarize(self):
+        """
+        :return: dictionary, case name: dictionary of summary metrics
+        """
+        summary = {}
+        reference = None
+        for name, records in self.results.items():
+            wall_times = np.array([r["wall_time"] for r in records])
+            solved = [r for r in records if r["status"] == 'optimal']
+            summary[name] = {
+                "n_solves": len(records),
+                "n_failed": len(records) - len(solved),
+                "mean_wall_time": float(np.mean(wall_times)),
+                "max_wall_time": float(np.max(wall_times)),
+                "mean_integer_variables": float(np.mean([r["n_integer"] for r in records])),
+                "comfort_violation": float(sum(r["comfort_violation"] for r in solved))
+            }
+            if reference is None:
+                reference = name
+            costs = {(r["home"], r["timestep"]): r["cost"] for r in solved}
+            ref_costs = {(r["home"], r["timestep"]): r["cost"] for r in self.results[reference] if r["status"] == 'optimal'}
+            common = [k for k in costs if k in ref_costs]
+            summary[name]["speedup"] = summary[reference]["mean_wall_time"] / summary[name]["mean_wall_time"]
+            summary[name]["cost_gap"] = float(np.mean([(costs[k] - ref_costs[k]) / max(abs(ref_costs[k]), 1e-6) for k in common])) if len(common) > 0 else None
+        return summary
+
+    def write_results(self, output_dir):
+        """
+        Writes the summary and per-solve records to benchmark-results.json and logs
+        a table of the summary.
+        :return: None
+        """
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        summary = self.summarize()
+        with open(os.path.join(output_dir, "benchmark-results.json"), 'w+') as f:
+            json.dump({"Summary": summary, "records": self.results}, f, indent=4)
+
+        table = PrettyTable(["case", "speedup", "mean time (s)", "max time (s)", "integer vars", "cost gap", "comfort violation", "failed"])
+        for name, s in summary.items():
+            table.add_row([name, round(s["speedup"], 2), round(s["mean_wall_time"], 3), round(s["max_wall_time"], 3),
+                           s["mean_integer_variables"], None if s["cost_gap"] is None else round(s["cost_gap"], 4),
+                           round(s["comfort_violation"], 3), s["n_failed"]])
+        self.log.logger.info(f"Solve benchmark:\n{table}")
@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import pickle
+
+# Local
+from dragg.aggregator import Aggregator
+from dragg.sweep import ParameterSweep
+
+def run_prefix(config, shared_data, timestep, file):
+    """
+    Top level function run in the process of the shared prefix.
+    :return: None
+    """
+    agg = Aggregator(config=config, shared_data=shared_data)
+    agg.run_prefix(timestep, file)
+    agg.executor.close()
+
+def run_branch(config, shared_data, snapshot):
+    """
+    Top level function run in the process of each branch.
+    :return: None
+    """
+    agg = Aggregator(config=config, shared_data=shared_data)
+    agg.run(branch_from=snapshot)
+    agg.executor.close()
+
+class ScenarioBranches(ParameterSweep):
+    """
+    Runs the baseline once up to [branches] fork_timestep and snapshots the
+    community there. Each case of [branches.cases] (config overrides, e.g. a new
+    TOU schedule) then continues from the snapshot in a forked process, as many
+    at a time as fit in max_cores. The results of a branch cover the whole run,
+    the shared prefix included. Later studies with the same prefix config and
+    fork_timestep reuse the snapshot.
+    """
+    config_section = "branches"
+
+    def __init__(self):
+        super().__init__()
+        self.fork_timestep = int(self.sweep_config.get('fork_timestep', 0))
+        self.prefix = self.set_case(f"{self.config['simulation']['named_version']}-prefix", {})
+        self.snapshot = os.path.join('outputs', 'snapshots', f"{self.prefix['version']}-{self.fork_timestep}.pkl")
+
+    def set_cases(self):
+        """
+        :return: list of dictionaries, a case for each table of [branches.cases]
+        """
+        return [self.set_case(f"{self.config['simulation']['named_version']}-{name}", overrides) for name, overrides in self.sweep_config.get('cases', {}).items()]
+
+    def snapshot_exists(self):
+        """
+        :return: bool, whether the snapshot was written by a prefix with the same
+        config (but for the branches) and fork timestep
+        """
+        if not os.path.isfile(self.snapshot):
+            return False
+        with open(self.snapshot, 'rb') as f:
+            state = pickle.load(f)
+        prefix_config = {k: v for k, v in self.prefix["config"].items() if k != self.config_section}
+        snapshot_config = {k: v for k, v in state["config"].items() if k != self.config_section}
+        return snapshot_config == prefix_config and state["aggregator"]["timestep"] == self.fork_timestep
+
+    def run(self):
+        """
+        Runs the shared prefix, unless its snapshot exists, then every branch.
+        :return: None
+        """
+        start = time.time()
+        self.load_shared_data([self.prefix] + self.cases)
+        if self.snapshot_exists():
+            self.log.logger.info(f"Reusing the snapshot {self.snapshot}.")
+        else:
+            self.run_cases([self.prefix], run_prefix, self.fork_timestep, self.snapshot)
+            if self.results[-1]["exitcode"] != 0:
+                self.log.logger.error("The shared prefix failed, no branch can run.")
+                self.write_results(time.time() - start)
+                sys.exit(1)
+        self.run_cases(self.cases, run_branch, self.snapshot)
+        self.write_results(time.time() - start)
+
+if __name__ == "__main__":
+    branches = ScenarioBranches()
+    branches.run()
@@ -0,0 +1,194 @@
+import os
+import sys
+import json
+import time
+import numpy as np
+from datetime import datetime, timedelta
+from copy import deepcopy
+
+# Local
+from dragg.aggregator import Aggregator
+from dragg.sweep import ParameterSweep, run_case
+
+class TimeChunks(ParameterSweep):
+    """
+    Time parallel baseline run. [start_datetime, end_datetime) is split into
+    n_chunks chunks run concurrently (as the cases of a sweep), each one starting
+    warmup_hours early from the homes' initial conditions so that the indoor and
+    water heater temperatures and battery charge converge before the chunk's
+    first timestep. The warm-up timesteps are dropped and the chunks stitched
+    into the results of the whole run. Only valid without a stateful aggregator
+    (the homes only carry over their own state from one timestep to the next).
+    """
+    config_section = "chunks"
+
+    def __init__(self):
+        super().__init__()
+        if not self.config['simulation']['run_rbo_mpc'] or self.config['agg'].get('surrogate', {}).get('enabled', False):
+            self.log.logger.error("Time parallel runs are only possible for baseline runs (run_rbo_mpc) without the surrogate.")
+            sys.exit(1)
+        self.sequential = self.set_case(f"{self.config['simulation']['named_version']}-sequential", {})
+        self.compare_sequential = self.sweep_config.get('compare_sequential', False)
+
+    def set_cases(self):
+        """
+        Splits the run into n_chunks chunks of whole hours.
+        :return: list of dictionaries, a case for each chunk, with its start
+        (hours from the start of the run) and number of warm-up hours
+        """
+        fmt = '%Y-%m-%d %H'
+        start_dt = datetime.strptime(self.config['simulation']['start_datetime'], fmt)
+        end_dt = datetime.strptime(self.config['simulation']['end_datetime'], fmt)
+        hours = int((end_dt - start_dt).total_seconds() / 3600)
+        n_chunks = int(np.clip(self.sweep_config.get('n_chunks', 1), 1, hours))
+        warmup_hours = int(self.sweep_config.get('warmup_hours', 24))
+        bounds = np.linspace(0, hours, n_chunks + 1).astype(int)
+
+        cases = []
+        for i in range(n_chunks):
+            first_hour = max(0, bounds[i] - warmup_hours)
+            case = self.set_case(f"{self.config['simulation']['named_version']}-chunk_{i}", {
+                "simulation.start_datetime": (start_dt + timedelta(hours=int(first_hour))).strftime(fmt),
+                "simulation.end_datetime": (start_dt + timedelta(hours=int(bounds[i+1]))).strftime(fmt)
+            })
+            case["offset"] = int(first_hour)
+            case["warmup"] = int(bounds[i] - first_hour)
+            cases.append(case)
+        return cases
+
+    def load_shared_data(self, cases):
+        """
+        Generates the homes of the whole run and gives each chunk the same homes,
+        offset to the chunk's first timestep (water draws and forecast errors).
+        :return: None
+        """
+        super().load_shared_data([self.sequential])
+        full = Aggregator(config=deepcopy(self.sequential["config"]), shared_data=self.shared_data)
+        homes = self.shared_data["homes"][full.population_key()]
+        for case in cases:
+            agg = Aggregator(config=deepcopy(case["config"]), shared_data=self.shared_data)
+            self.shared_data["homes"][agg.population_key()] = [{
+                **home,
+                "timestep_offset": case["offset"] * agg.dt # same water draws and forecast errors as the sequential run
+            } for home in homes]
+            agg.executor.close()
+        full.executor.close()
+
+    def results_file(self, case):
+        """
+        :return: str, path of the baseline results of a case
+        """
+        return os.path.join(self.case_run_dir(case), "baseline", "results.json")
+
+    def stitch(self, chunks):
+        """
+        Drops the warm-up timesteps of each chunk and concatenates the chunks.
+        :param chunks: list of the results of each chunk
+        :return: dictionary, results of the whole run
+        """
+        data = {}
+        summary_keys = ["p_grid_aggregate", "RP", "p_grid_setpoint", "OAT", "GHI"]
+        for case, results in zip(self.cases, chunks):
+            n = len(results["Summary"]["p_grid_aggregate"])
+            w = case["warmup"] * self.dt
+            for name, vals in results.items():
+                if name == "Summary":
+                    continue
+                if not name in data:
+                    data[name] = {k: v if not isinstance(v, list) else [] for k, v in vals.items()}
+                for k, v in vals.items():
+                    if not isinstance(v, list):
+                        continue
+                    if len(v) == n + 1: # states, starting with the initial one
+                        data[name][k] += v[:1] + v[w+1:] if len(data[name][k]) == 0 else v[w+1:]
+                    else:
+                        data[name][k] += v[w:]
+            for k in summary_keys:
+                data.setdefault("Summary", {}).setdefault(k, [])
+                data["Summary"][k] += results["Summary"][k][w:]
+            for k in ["SPP", "TOU"]: # nested in a list
+                if k in results["Summary"]:
+                    data["Summary"].setdefault(k, [[]])
+                    data["Summary"][k][0] += results["Summary"][k][0][w:]
+        data["Summary"].update({
+            "case": "baseline",
+            "start_datetime": self.config['simulation']['start_datetime'],
+            "end_datetime": self.config['simulation']['end_datetime'],
+            "solve_time": sum(results["Summary"]["solve_time"] for results in chunks),
+            "horizon": self.config['home']['hems']['prediction_horizon'],
+            "num_homes": self.config['community']['total_number_homes'],
+            "p_max_aggregate": max(data["Summary"]["p_grid_aggregate"])
+        })
+        return data
+
+    def boundary_error(self, stitched, sequential):
+        """
+        Compares the stitched run against the sequential run, overall and after
+        each chunk boundary.
+        :return: dictionary
+        """
+        p_stitched = np.array(stitched["Summary"]["p_grid_aggregate"])
+        p_sequential = np.array(sequential["Summary"]["p_grid_aggregate"])
+        homes = [name for name in sequential if name != "Summary"]
+        temp = {
+            "p_grid_aggregate_mae": float(np.mean(np.abs(p_stitched - p_sequential))),
+            "energy_error": float((np.sum(p_stitched) - np.sum(p_sequential)) / max(1e-6, abs(np.sum(p_sequential)))),
+            "boundaries": []
+        }
+        for case in self.cases[1:]:
+            t = (case["offset"] + case["warmup"]) * self.dt
+            window = slice(t, t + 24 * self.dt)
+            boundary = {
+                "timestep": t,
+                "p_grid_aggregate_mae_next_day": float(np.mean(np.abs(p_stitched[window] - p_sequential[window])))
+            }
+            for k in ["temp_in_opt", "temp_wh_opt", "e_batt_opt"]:
+                errors = [abs(stitched[name][k][t+1] - sequential[name][k][t+1]) for name in homes if k in sequential[name]] # state after the chunk's first timestep
+                if len(errors) > 0:
+                    boundary[f"{k}_max_error"] = float(max(errors))
+            temp["boundaries"].append(boundary)
+        return temp
+
+    def run(self):
+        """
+        Runs the chunks (and the sequential run, with compare_sequential), then
+        writes the stitched results to the run directory of named_version.
+        :return: None
+        """
+        start = time.time()
+        self.load_shared_data(self.cases)
+        self.dt = int(self.config['agg']['subhourly_steps'])
+        self.run_cases(self.cases + ([self.sequential] if self.compare_sequential else []), run_case)
+        if any(r["exitcode"] != 0 for r in self.results):
+            self.log.logger.error("A chunk failed, the results cannot be stitched.")
+            self.write_results(time.time() - start)
+            sys.exit(1)
+
+        chunks = []
+        for case in self.cases:
+            with open(self.results_file(case)) as f:
+                chunks.append(json.load(f))
+        stitched = self.stitch(chunks)
+        stitched["Summary"]["time_parallel"] = {
+            "n_chunks": len(self.cases),
+            "warmup_hours": int(self.sweep_config.get('warmup_hours', 24)),
+            "wall_time": time.time() - start,
+            "chunks": [{"start_datetime": case["config"]['simulation']['start_datetime'], "warmup_timesteps": case["warmup"] * self.dt} for case in self.cases]
+        }
+        if self.compare_sequential:
+            with open(self.results_file(self.sequential)) as f:
+                sequential = json.load(f)
+            stitched["Summary"]["time_parallel"]["boundary_error"] = self.boundary_error(stitched, sequential)
+            self.log.logger.info(f"Boundary error against the sequential run: {stitched['Summary']['time_parallel']['boundary_error']}")
+
+        case = self.set_case(self.config['simulation']['named_version'], {})
+        file = self.results_file(case)
+        if not os.path.isdir(os.path.dirname(file)):
+            os.makedirs(os.path.dirname(file))
+        with open(file, 'w+') as f:
+            json.dump(stitched, f, indent=4)
+        self.write_results(time.time() - start)
+
+if __name__ == "__main__":
+    chunks = TimeChunks()
+    chunks.run()
@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import time
+import numpy as np
+
+# Local
+from dragg.aggregator import Aggregator
+from dragg.sweep import ParameterSweep
+
+def run_member(config, shared_data, ensemble_dir):
+    """
+    Top level function run in the process of each ensemble member. Runs the
+    baseline without writing its results and saves the aggregate load to
+    <named_version>.npy in ensemble_dir.
+    :return: None
+    """
+    agg = Aggregator(config=config, shared_data=shared_data)
+    agg.case = "baseline"
+    agg.checkpoint_interval = agg.num_timesteps + 1 # no checkpoints
+    agg.flush_redis()
+    agg.get_homes()
+    agg.set_archetypes()
+    agg.reset_collected_data()
+    agg.run_baseline()
+    agg.redis_client.flush()
+    agg.executor.close()
+    np.save(os.path.join(ensemble_dir, f"{config['simulation']['named_version']}.npy"), np.array(agg.baseline_agg_load_list))
+
+class Ensemble(ParameterSweep):
+    """
+    Monte Carlo ensemble of the baseline over the homes' forecast errors. Each of
+    the n_members members runs the same community with its own forecast_seed, as
+    the cases of a sweep (sharing the weather data and homes), and only returns its
+    aggregate load. The per timestep quantiles of the aggregate load over the
+    members are written in place of the members' results.
+    """
+    config_section = "ensemble"
+
+    def __init__(self):
+        super().__init__()
+        if not self.config['simulation']['run_rbo_mpc'] or self.config['agg'].get('surrogate', {}).get('enabled', False):
+            self.log.logger.error("Ensembles are only possible for baseline runs (run_rbo_mpc) without the surrogate.")
+            sys.exit(1)
+        self.quantiles = [float(q) for q in self.sweep_config.get('quantiles', [0.05, 0.5, 0.95])]
+        self.ensemble = self.set_case(self.config['simulation']['named_version'], {})
+
+    def set_cases(self):
+        """
+        :return: list of dictionaries, a case for each member, member i with
+        forecast_seed i + 1
+        """
+        n_members = int(self.sweep_config.get('n_members', 1))
+        return [self.set_case(f"{self.config['simulation']['named_version']}-member_{i}", {"home.hems.forecast_seed": i + 1}) for i in range(n_members)]
+
+    def run(self):
+        """
+        Runs the members and writes the quantiles of their aggregate load to
+        ensemble/results.json and the loads of all members to ensemble/members.npy
+        in the run directory of named_version.
+        :return: None
+        """
+        start = time.time()
+        ensemble_dir = os.path.join(self.case_run_dir(self.ensemble), "ensemble")
+        if not os.path.isdir(ensemble_dir):
+            os.makedirs(ensemble_dir)
+        files = {case["version"]: os.path.join(ensemble_dir, f"{case['version']}.npy") for case in self.cases}
+
+        self.load_shared_data(self.cases[:1]) # the members differ only in their HEMS parameters
+        self.run_cases(self.cases, run_member, ensemble_dir)
+
+        members = [r["version"] for r in self.results if r["exitcode"] == 0]
+        failed = [r["version"] for r in self.results if r["exitcode"] != 0]
+        if len(members) == 0:
+            self.log.logger.error("Every ensemble member failed.")
+            self.write_results(time.time() - start)
+            sys.exit(1)
+        loads = np.array([np.load(files[version]) for version in members])
+        for version in members:
+            os.remove(files[version])
+        np.save(os.path.join(ensemble_dir, "members.npy"), loads)
+
+        summary = {
+            "start_datetime": self.config['simulation']['start_datetime'],
+            "end_datetime": self.config['simulation']['end_datetime'],
+            "num_homes": self.config['community']['total_number_homes'],
+            "horizon": self.config['home']['hems']['prediction_horizon'],
+            "n_members": len(members),
+            "failed_members": failed,
+            "wall_time": time.time() - start,
+            "p_grid_aggregate_mean": loads.mean(axis=0).tolist(),
+            "p_grid_aggregate_std": loads.std(axis=0).tolist(),
+            "p_grid_aggregate_quantiles": {str(q): np.quantile(loads, q, axis=0).tolist() for q in self.quantiles},
+            "p_max_aggregate_quantiles": {str(q): float(np.quantile(loads.max(axis=1), q)) for q in self.quantiles}
+        }
+        with open(os.path.join(ensemble_dir, "results.json"), 'w+') as f:
+            json.dump({"Summary": summary}, f, indent=4)
+        self.log.logger.info(f"Wrote the quantiles of {len(members)} ensemble members to {ensemble_dir}.")
+        self.write_results(time.time() - start)
+
+if __name__ == "__main__":
+    ensemble = Ensemble()
+    ensemble.run()
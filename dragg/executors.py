@@ -0,0 +1,274 @@
+import sys
+import json
+import time
+import uuid
+import base64
+import dill
+from copy import copy
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor as ThreadPool
+
+# Local
+from dragg.redis_client import RedisClient
+from dragg.supervisor import WorkerSupervisor
+
+TASK_QUEUE = "dragg:tasks" # redis list of pending tasks (within the namespace), see RedisQueueExecutor
+PROCESSING_QUEUE = "dragg:processing" # redis list of the tasks taken by a worker
+LEASE_GRACE = 2 # s, time a worker has to take the lease of a task it moved to PROCESSING_QUEUE
+
+def encode(obj):
+    """
+    Serializes an object for a redis client with decode_responses = True.
+    :return: str
+    """
+    return base64.b64encode(dill.dumps(obj)).decode('ascii')
+
+def decode(data):
+    """
+    :param data: str, as returned by encode
+    :return: the object
+    """
+    return dill.loads(base64.b64decode(data))
+
+def lease_key(task):
+    """
+    :param task: dictionary, a RedisQueueExecutor task
+    :return: str, redis key that exists while a worker holds the task
+    """
+    return f"dragg:lease:{task['batch']}:{task['id']}:{task['attempt']}"
+
+class Executor(ABC):
+    """
+    Interface shared by the backends that run the home steps (or any function
+    of a list of items) of a timestep. map() never raises for a failed item,
+    the caller decides how to recover.
+    """
+    backend = None
+
+    def __init__(self, n_workers, log):
+        """
+        :param n_workers: int, number of workers (threads or processes)
+        :param log: logging.Logger
+        """
+        self.n_workers = n_workers
+        self.log = log
+        self.failures = 0
+
+    @abstractmethod
+    def map(self, func, items, name=str):
+        """
+        Runs func on every item.
+        :param name: function giving an identifier of an item for the logs
+        :return: tuple (list of results in the order of items, None for a failed
+        item, list of the items that failed)
+        """
+        pass
+
+    def summary(self):
+        """
+        :return: dictionary of executor metrics
+        """
+        return {
+            "backend": self.backend,
+            "failures": self.failures
+        }
+
+    def close(self):
+        """
+        Releases the workers.
+        :return: None
+        """
+        return
+
+class SerialExecutor(Executor):
+    """
+    Runs every item in the calling process, one after the other. Items are
+    shallow copied so that, as with the process backends, changes func makes to
+    an item are not seen by the caller. For profiling and debugging.
+    """
+    backend = "serial"
+
+    def map(self, func, items, name=str):
+        results = []
+        failed = []
+        for item in items:
+            try:
+                results.append(func(copy(item)))
+            except Exception as e:
+                self.log.error(f"Task for {name(item)} failed: {e}")
+                results.append(None)
+                failed.append(item)
+        self.failures += len(failed)
+        return results, failed
+
+class ThreadExecutor(Executor):
+    """
+    Runs items on a pool of threads in the calling process. Only faster than the
+    serial backend with solvers that release the GIL while solving.
+    """
+    backend = "thread"
+
+    def __init__(self, n_workers, log):
+        super().__init__(n_workers, log)
+        self.pool = ThreadPool(max_workers=n_workers)
+
+    def map(self, func, items, name=str):
+        tasks = [(item, self.pool.submit(func, copy(item))) for item in items]
+        results = []
+        failed = []
+        for item, task in tasks:
+            try:
+                results.append(task.result())
+            except Exception as e:
+                self.log.error(f"Task for {name(item)} failed: {e}")
+                results.append(None)
+                failed.append(item)
+        self.failures += len(failed)
+        return results, failed
+
+    def close(self):
+        self.pool.shutdown()
+
+class ProcessExecutor(Executor):
+    """
+    Runs items on a persistent pathos process pool, with the task timeout and
+    worker memory limit of WorkerSupervisor.
+    """
+    backend = "process"
+
+    def __init__(self, n_workers, log, task_timeout=0, max_worker_memory=0):
+        super().__init__(n_workers, log)
+        self.supervisor = WorkerSupervisor(n_workers, task_timeout, max_worker_memory, log)
+
+    def map(self, func, items, name=str):
+        return self.supervisor.map(func, items, name=name)
+
+    def summary(self):
+        return {"backend": self.backend, **self.supervisor.summary()}
+
+class RedisQueueExecutor(Executor):
+    """
+    Pushes items to a redis list, TASK_QUEUE, from which any number of worker
+    processes (see dragg.worker) on any machine sharing the redis server take
+    them. A worker moves the task to PROCESSING_QUEUE and holds a lease on it,
+    which it renews while func runs, and sends the task's state writes (see
+    RedisClient.write) with its result. map() returns once every item has a result,
+    and puts back on the queue the tasks whose lease expired (lost workers).
+    Queues are in the redis namespace of the simulation, workers have to be
+    started with the same namespace.
+    """
+    backend = "redis"
+
+    def __init__(self, n_workers, log, task_timeout=0, lease_timeout=30, max_task_attempts=3):
+        """
+        :param task_timeout: float, seconds to wait for the next result, 0 to wait
+        indefinitely
+        :param lease_timeout: float, seconds after which a task whose worker stopped
+        renewing its lease is given to another worker
+        :param max_task_attempts: int, number of workers a task is given to before
+        it fails
+        """
+        super().__init__(n_workers, log)
+        self.task_timeout = task_timeout
+        self.lease_timeout = lease_timeout
+        self.max_task_attempts = max_task_attempts
+        self.requeued = 0
+        self.redis_client = RedisClient()
+
+    def map(self, func, items, name=str):
+        batch = uuid.uuid4().hex
+        for i, item in enumerate(items):
+            task = {"batch": batch, "id": i, "attempt": 0, "lease": self.lease_timeout, "task": encode((func, item))}
+            self.redis_client.conn.rpush(self.redis_client.key(TASK_QUEUE), json.dumps(task))
+
+        pending = set(range(len(items)))
+        unleased = {} # task message: time it was first seen without a lease
+        last_result = time.time()
+        while len(pending) > 0:
+            done = self.redis_client.conn.blpop(self.redis_client.key(f"dragg:done:{batch}"), timeout=1)
+            if done is not None:
+                pending.discard(int(done[1]))
+                last_result = time.time()
+                continue
+            self.requeue_lost(batch, pending, unleased)
+            if self.task_timeout > 0 and time.time() - last_result > self.task_timeout:
+                self.log.error(f"No result from the redis workers for {self.task_timeout} s.")
+                break
+        posted = self.redis_client.conn.hgetall(self.redis_client.key(f"dragg:results:{batch}"))
+        self.clear_batch(batch)
+
+        results = []
+        failed = []
+        for i, item in enumerate(items):
+            result = decode(posted[str(i)]) if str(i) in posted else {"error": "no result"}
+            if "error" in result:
+                self.log.error(f"Task for {name(item)} failed: {result['error']}")
+                results.append(None)
+                failed.append(item)
+            else:
+                results.append(result["result"])
+        self.failures += len(failed)
+        return results, failed
+
+    def requeue_lost(self, batch, pending, unleased):
+        """
+        Puts the tasks of the batch whose lease expired back at the head of the
+        queue, or fails them after max_task_attempts.
+        :return: None
+        """
+        for message in self.redis_client.conn.lrange(self.redis_client.key(PROCESSING_QUEUE), 0, -1):
+            task = json.loads(message)
+            if task["batch"] != batch or not task["id"] in pending:
+                continue
+            if self.redis_client.conn.exists(self.redis_client.key(lease_key(task))):
+                unleased.pop(message, None)
+                continue
+            if time.time() - unleased.setdefault(message, time.time()) < LEASE_GRACE:
+                continue
+            if self.redis_client.conn.lrem(self.redis_client.key(PROCESSING_QUEUE), 1, message) == 0: # finished in the meantime
+                continue
+            task["attempt"] += 1
+            if task["attempt"] >= self.max_task_attempts:
+                self.redis_client.conn.hset(self.redis_client.key(f"dragg:results:{batch}"), task["id"], encode({"error": f"lease expired {task['attempt']} times"}))
+                self.redis_client.conn.rpush(self.redis_client.key(f"dragg:done:{batch}"), task["id"])
+            else:
+                self.log.warning(f"Lease of task {task['id']} expired, requeueing it (attempt {task['attempt'] + 1}).")
+                self.redis_client.conn.lpush(self.redis_client.key(TASK_QUEUE), json.dumps(task))
+                self.requeued += 1
+
+    def clear_batch(self, batch):
+        """
+        Removes the results of the batch and any of its tasks left in the queues.
+        :return: None
+        """
+        self.redis_client.conn.delete(self.redis_client.key(f"dragg:results:{batch}"), self.redis_client.key(f"dragg:done:{batch}"))
+        for queue in [self.redis_client.key(TASK_QUEUE), self.redis_client.key(PROCESSING_QUEUE)]:
+            for message in self.redis_client.conn.lrange(queue, 0, -1):
+                if json.loads(message)["batch"] == batch:
+                    self.redis_client.conn.lrem(queue, 1, message)
+
+    def summary(self):
+        return {
+            "backend": self.backend,
+            "failures": self.failures,
+            "requeued": self.requeued
+        }
+
+def get_executor(config, log):
+    """
+    :param config: dictionary, the [simulation] section of the config file
+    :param log: logging.Logger
+    :return: Executor of the configured backend
+    """
+    backend = config.get('executor', 'process')
+    if backend == "serial":
+        return SerialExecutor(config['n_nodes'], log)
+    elif backend == "thread":
+        return ThreadExecutor(config['n_nodes'], log)
+    elif backend == "process":
+        return ProcessExecutor(config['n_nodes'], log, config.get('task_timeout', 0), config.get('max_worker_memory', 0))
+    elif backend == "redis":
+        return RedisQueueExecutor(config['n_nodes'], log, config.get('task_timeout', 0),
+                                  config.get('lease_timeout', 30), config.get('max_task_attempts', 3))
+    log.error(f"Unknown executor {backend}, expected one of serial, thread, process, redis.")
+    sys.exit(1)
@@ -1,10 +1,15 @@
+import argparse
+
 from dragg.aggregator import Aggregator
 from dragg.reformat import Reformat
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", action="store_true", help="continue the run from its latest checkpoint")
+    args = parser.parse_args()
 
     a = Aggregator()
-    a.run()
+    a.run(resume=args.resume)
 
     # agg_params = {"alpha": [0.0625], "beta":[1.0], "epsilon":[0.05, 0.025], "rl_horizon":[], "mpc_disutility":[]} # set parameters from earlier runs
     # mpc_params = {"mpc_hourly_steps": [4], "mpc_prediction_horizons": [1], "mpc_discomfort":[]}
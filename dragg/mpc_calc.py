@@ -8,18 +8,64 @@ import logging
 import pathos
 from collections import defaultdict
 import json
-from copy import deepcopy
+import time
+import zlib
+import hashlib
+import resource
+import threading
+from copy import copy, deepcopy
+from collections import OrderedDict
 
 from dragg.redis_client import RedisClient
 from dragg.logger import Logger
+from dragg.solution_cache import get_solution_cache
+
+_problem_templates = OrderedDict() # parametrized problems of the current (worker) process, see MPCCalc.load_template
+_templates_lock = threading.Lock() # homes of the thread executor share the templates
+_draw_schedules = {} # memory mapped water draw schedules of the current (worker) process, by file
+
+def draw_schedule(wh):
+    """
+    Hourly water draws of a home from the start of the run, a row of the draw
+    schedules of its population (see Aggregator.write_population). The schedules
+    are memory mapped once per process, so the homes pickled to the workers only
+    carry the file and row.
+    :param wh: dictionary, the home's water heater parameters
+    :return: numpy.ndarray
+    """
+    if "draw_sizes" in wh: # listed in the home config
+        return np.array(wh["draw_sizes"])
+    if not wh["draw_file"] in _draw_schedules:
+        _draw_schedules[wh["draw_file"]] = np.load(wh["draw_file"], mmap_mode='r')
+    return _draw_schedules[wh["draw_file"]][wh["draw_index"]]
 
 def manage_home(home):
     """
     Calls class method as a top level function (picklizable by pathos)
-    :return: None
+    :return: dictionary with the home name, its run time (s), the worker pid and
+    the worker's peak resident memory (kB)
     """
+    start = time.time()
     home.run_home()
-    return
+    return {
+        "name": home.name,
+        "solve_time": time.time() - start,
+        "pid": os.getpid(),
+        "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+def propose_home(home):
+    """
+    Top level function (picklizable by pathos) solving a home at the current
+    reward price without implementing the plan (see Aggregator.coordinate_prices).
+    :return: dictionary as returned by manage_home, with the planned grid load
+    over the horizon (kW)
+    """
+    home = copy(home) # the flag must not stick to a home run in the calling process
+    home.proposal_only = True
+    result = manage_home(home)
+    result["p_grid"] = home.proposal
+    return result
 
 class MPCCalc:
     def __init__(self, home):
@@ -28,6 +74,7 @@ class MPCCalc:
         home: Dictionary with keys for HVAC, WH, and optionally PV, battery parameters
         """
         self.home = home  # reset every time home retrieved from Queue
+        self.namespace = RedisClient().namespace # redis namespace of the simulation, travels with the home to its worker
         self.name = home['name']
         self.type = self.home['type']  # reset every time home retrieved from Queue
         self.start_hour_index = None  # set once upon thread init
@@ -76,7 +123,14 @@ class MPCCalc:
         self.assumed_wh_draw = None
         self.prev_optimal_vals = None  # set after timestep > 0, set_vals_for_current_run
         self.timestep = 0
+        self.timestep_offset = int(self.home.get("timestep_offset", 0)) # timesteps from the start of the whole run to this one's, for time parallel chunks
         self.p_grid_opt = None
+        self.status = None # solver status, or "optimal" for a reused plan
+        self.solution = None # numpy values of the optimal plan, set by collect_solution or simulate_plan
+        self.cache_hit = 0
+        self.solve_skipped = 0
+        self.plan_age = 0 # timesteps since the stored plan was solved
+        self.late_solve = 0
 
         # setup cvxpy verbose solver
         self.verbose_flag = os.environ.get('VERBOSE','False')
@@ -97,32 +151,41 @@ class MPCCalc:
             # setup the pv variables
             self.setup_pv_problem()
 
+    def __getstate__(self):
+        """
+        Leaves the redis connection out of a home sent to a worker, run_home
+        opens the worker's own.
+        :return: dictionary
+        """
+        state = self.__dict__.copy()
+        state.pop("redis_client", None)
+        return state
+
     def redis_write_optimal_vals(self):
         """
         Sends the optimal values for each home to the redis server.
         :return: None
         """
-        key = self.name
-        for field, value in self.optimal_vals.items():
-            self.redis_client.conn.hset(key, field, value)
+        self.redis_client.write("hset", self.redis_client.key(self.name), mapping=self.optimal_vals)
 
     def redis_get_prev_optimal_vals(self):
         """
         Collects starting point environmental values for all homes (such as current temperature).
         :return: None
         """
-        key = self.name
+        key = self.redis_client.key(self.name)
         self.prev_optimal_vals = self.redis_client.conn.hgetall(key)
 
     def initialize_environmental_variables(self):
         self.redis_client = RedisClient()
+        self.redis_client.namespace = self.namespace
 
         # collect all values necessary
-        self.start_hour_index = self.redis_client.conn.get('start_hour_index')
-        self.all_ghi = self.redis_client.conn.lrange('GHI', 0, -1)
-        self.all_oat = self.redis_client.conn.lrange('OAT', 0, -1)
-        self.all_spp = self.redis_client.conn.lrange('SPP', 0, -1)
-        self.all_tou = self.redis_client.conn.lrange('tou', 0, -1)
+        self.start_hour_index = self.redis_client.conn.get(self.redis_client.key('start_hour_index'))
+        self.all_ghi = self.redis_client.conn.lrange(self.redis_client.key('GHI'), 0, -1)
+        self.all_oat = self.redis_client.conn.lrange(self.redis_client.key('OAT'), 0, -1)
+        self.all_spp = self.redis_client.conn.lrange(self.redis_client.key('SPP'), 0, -1)
+        self.all_tou = self.redis_client.conn.lrange(self.redis_client.key('tou'), 0, -1)
         self.base_cents = float(self.all_tou[0])
 
         # cast all values to proper type
@@ -150,6 +213,31 @@ class MPCCalc:
         self.horizon = max(1, int(self.home['hems']['horizon'] * self.dt))
         self.h_plus = self.horizon + 1
         self.discount = float(self.home['hems']['discount_factor'])
+        self.bid_prices = [float(i) for i in self.home['hems'].get('bid_prices', [])]
+        self.cache_size = int(self.home['hems'].get('cache_size', 0))
+        self.cache_policy = self.home['hems'].get('cache_policy', 'lru')
+        self.cache_temp_resolution = float(self.home['hems'].get('cache_temp_resolution', 0.25))
+        self.cache_price_resolution = float(self.home['hems'].get('cache_price_resolution', 0.005))
+        self.cache_draw_resolution = float(self.home['hems'].get('cache_draw_resolution', 1.0))
+        self.cache_param_decimals = int(self.home['hems'].get('cache_param_decimals', 2))
+        self.event_triggered = bool(self.home['hems'].get('event_triggered', False))
+        self.event_temp_tol = float(self.home['hems'].get('event_temp_tol', 0.5))
+        self.event_price_tol = float(self.home['hems'].get('event_price_tol', 0.001))
+        self.event_draw_tol = float(self.home['hems'].get('event_draw_tol', 1.0))
+        self.event_max_age = int(self.home['hems'].get('event_max_age', self.horizon - 1))
+        self.resolve_due = True # set False by the aggregator on the steps this home only executes its plan
+        self.fallback_only = False # set True by the aggregator when this home's worker failed
+        self.proposal_only = False # set True by propose_home, solves without writing the home's state
+        self.proposal = None # planned grid load over the horizon, set by run_home when proposal_only
+        self.move_blocks = self.block_matrix(self.home['hems'].get('move_block_lengths', []))
+        self.solve_mode = self.home['hems'].get('solve_mode', 'milp') # "milp" or "lp_round"
+        if self.solve_mode == 'lp_round' and self.solver == cp.GLPK_MI:
+            self.solver = cp.GLPK # the relaxation is a linear program
+        self.template_cache_size = int(self.home['hems'].get('template_cache_size', 0))
+        self.template_digest = hashlib.sha256(json.dumps(self.home, sort_keys=True, default=str).encode()).hexdigest() # the home's parameters and HEMS settings are constants of its problem
+        self.solver_time_limit = float(self.home['hems'].get('solver_time_limit', 0)) # s, 0 for no limit
+        self.solver_mip_gap = float(self.home['hems'].get('solver_mip_gap', 0)) # relative, 0 for the solver default
+        self.forecast_seed = int(self.home['hems'].get('forecast_seed', 0)) # realization of the forecast errors the home plans on, 0 for perfect forecasts
 
         # Initialize RP structure so that non-forecasted RPs have an expected value of 0.
         self.reward_price = np.zeros(self.horizon)
@@ -168,9 +256,9 @@ class MPCCalc:
         self.temp_wh_ev = cp.Variable(self.h_plus)
         self.temp_wh = cp.Variable(1)
         self.p_grid = cp.Variable(self.horizon)
-        self.hvac_cool_on = cp.Variable(self.horizon, integer=True)
-        self.hvac_heat_on = cp.Variable(self.horizon, integer=True)
-        self.wh_heat_on = cp.Variable(self.horizon, integer=True)
+        self.hvac_cool_var = self.duty_variable() # only added to the problem in "summer"
+        self.hvac_heat_var = self.duty_variable() # only added to the problem in "winter"
+        self.wh_heat_on = self.duty_variable()
 
         # Water heater temperature constraints
         self.temp_wh_min = cp.Constant(float(self.home["wh"]["temp_wh_min"]))
@@ -190,9 +278,50 @@ class MPCCalc:
 
         self.max_load = (max(self.hvac_p_c.value, self.hvac_p_h.value) + self.wh_p.value) * self.sub_subhourly_steps
 
+    def block_matrix(self, lengths):
+        """
+        Move blocking. Maps control blocks onto the timesteps of the horizon, e.g.
+        [1, 1, 1, 1, 4, 8] keeps four single-step moves and then holds each
+        move for 4 and then 8 timesteps. The last length repeats until the horizon
+        is covered.
+        :param lengths: list of int, number of timesteps in each block
+        :return: numpy.ndarray (horizon x number of blocks), or None for one move per timestep
+        """
+        lengths = [int(l) for l in lengths if int(l) > 0]
+        if len(lengths) == 0 or all(l == 1 for l in lengths):
+            return None
+
+        starts = []
+        t = 0
+        i = 0
+        while t < self.horizon:
+            starts.append(t)
+            t += lengths[min(i, len(lengths) - 1)]
+            i += 1
+
+        blocks = np.zeros((self.horizon, len(starts)))
+        for b, start in enumerate(starts):
+            end = starts[b+1] if b + 1 < len(starts) else self.horizon
+            blocks[start:end, b] = 1
+        return blocks
+
+    def duty_variable(self):
+        """
+        Integer on/off variable for the HVAC and water heater over the horizon
+        (continuous in the lp_round solve mode). With move blocking, one variable
+        is shared by all the timesteps of a block.
+        :return: cvxpy.Variable or cvxpy.Expression of length horizon
+        """
+        integer = not self.solve_mode == 'lp_round'
+        if self.move_blocks is None:
+            return cp.Variable(self.horizon, integer=integer)
+        return cp.Constant(self.move_blocks) @ cp.Variable(self.move_blocks.shape[1], integer=integer)
+
     def water_draws(self):
-        draw_sizes = (self.horizon // self.dt + 1) * [0] + self.home["wh"]["draw_sizes"]
-        raw_draw_size_list = draw_sizes[(self.timestep // self.dt):(self.timestep // self.dt) + (self.horizon // self.dt + 1)]
+        n_hours = self.horizon // self.dt + 1
+        hour = (self.timestep + self.timestep_offset) // self.dt
+        draw_sizes = draw_schedule(self.home["wh"])[max(0, hour - n_hours):hour] # the draws of the n_hours before this hour, zeros before the start of the run
+        raw_draw_size_list = [0] * (n_hours - len(draw_sizes)) + draw_sizes.tolist()
         raw_draw_size_list = (np.repeat(raw_draw_size_list, self.dt) / self.dt).tolist()
         draw_size_list = raw_draw_size_list[:self.dt]
         for i in range(self.dt, self.h_plus):
@@ -219,17 +348,57 @@ class MPCCalc:
 
         self.oat_current = self.all_oat[start_slice:end_slice]
         self.oat_current_ev = deepcopy(self.oat_current)
-        oat_noise = np.multiply(np.power(1.1*np.ones(self.horizon), np.arange(self.horizon)), np.random.randn(self.horizon))
+        seed = [zlib.crc32(self.name.encode()), self.timestep + self.timestep_offset] + ([self.forecast_seed] if self.forecast_seed else [])
+        rng = np.random.default_rng(seed) # same forecast error whichever process solves the home, e.g. after a resume
+        oat_noise = np.multiply(np.power(1.1*np.ones(self.horizon), np.arange(self.horizon)), rng.standard_normal(self.horizon))
         self.oat_current_ev[1:] = np.add(self.oat_current[1:], oat_noise)
 
         self.tou_current = self.all_tou[start_slice:end_slice]
         self.base_price = np.array(self.tou_current, dtype=float)
 
-        # Set values as cvxpy values
-        self.oat_forecast = cp.Constant(self.oat_current)
-        self.ghi_forecast = cp.Constant(self.ghi_current)
+        # Set values as cvxpy values, planning on the forecasts with errors when given a forecast_seed
+        self.oat_forecast = cp.Constant(self.oat_current_ev if self.forecast_seed else self.oat_current)
+        self.ghi_forecast = cp.Constant(self.ghi_current_ev if self.forecast_seed else self.ghi_current)
+        self.oat_actual = cp.Constant(self.oat_current[1]) # the implemented step follows the actual weather
         self.cast_redis_curr_rps()
 
+        # set total price for electricity
+        total_price = np.array(self.reward_price, dtype=float) + self.base_price[:self.horizon]
+        if len(self.bid_prices) > 0:
+            # a parameter lets the bid curve re-solve the same compiled problem
+            self.total_price = cp.Parameter(self.horizon, value=total_price)
+        else:
+            self.total_price = cp.Constant(total_price)
+
+    def set_operating_mode(self):
+        """
+        Sets the bounds of the HVAC and water heater by season and whether the PV
+        system can generate over the horizon. Systems that cannot run are left
+        out of the problem.
+        :return: None
+        """
+        self.hvac_heat_min = 0
+        self.hvac_cool_min = 0
+        self.wh_heat_max = self.sub_subhourly_steps
+        self.wh_heat_min = 0
+        # Set constraints on HVAC by season
+        if max(self.oat_current_ev) <= 30: # "winter"
+            self.hvac_heat_max = self.sub_subhourly_steps
+            self.hvac_cool_max = 0
+
+        else: # "summer"
+            self.hvac_heat_max = 0
+            self.hvac_cool_max = self.sub_subhourly_steps
+
+        zeros = cp.Constant(np.zeros(self.horizon))
+        self.hvac_cool_on = self.hvac_cool_var if self.hvac_cool_max > 0 else zeros
+        self.hvac_heat_on = self.hvac_heat_var if self.hvac_heat_max > 0 else zeros
+
+        if 'pv' in self.type:
+            self.pv_on = max(self.ghi_current[:self.horizon]) > 0
+            self.p_pv = self.p_pv_var if self.pv_on else zeros
+            self.u_pv_curt = self.u_pv_curt_var if self.pv_on else zeros
+
     def setup_battery_problem(self):
         """
         Adds CVX variables for battery subsystem in battery and battery_pv homes.
@@ -258,8 +427,8 @@ class MPCCalc:
         self.pv_eff = cp.Constant(float(self.home["pv"]["eff"]))
 
         # Define PV Optimization variables
-        self.p_pv = cp.Variable(self.horizon)
-        self.u_pv_curt = cp.Variable(self.horizon)
+        self.p_pv_var = cp.Variable(self.horizon) # only added to the problem while there is sun in the horizon
+        self.u_pv_curt_var = cp.Variable(self.horizon)
 
     def get_initial_conditions(self):
         self.water_draws()
@@ -294,20 +463,6 @@ class MPCCalc:
         water heater.
         :return: None
         """
-
-        self.hvac_heat_min = 0
-        self.hvac_cool_min = 0
-        self.wh_heat_max = self.sub_subhourly_steps
-        self.wh_heat_min = 0
-        # Set constraints on HVAC by season
-        if max(self.oat_current_ev) <= 30: # "winter"
-            self.hvac_heat_max = self.sub_subhourly_steps
-            self.hvac_cool_max = 0
-
-        else: # "summer"
-            self.hvac_heat_max = 0
-            self.hvac_cool_max = self.sub_subhourly_steps
-
         self.constraints = [
             # Indoor air temperature constraints
             self.temp_in_ev[0] == self.temp_in_init,
@@ -319,7 +474,7 @@ class MPCCalc:
             self.temp_in_ev[1:self.h_plus] <= self.temp_in_max,
 
             self.temp_in == self.temp_in_init
-                            + 3600 * (((self.oat_current[1] - self.temp_in_init) / self.home_r)
+                            + 3600 * (((self.oat_actual - self.temp_in_init) / self.home_r)
                             - self.hvac_cool_on[0] * self.hvac_p_c
                             + self.hvac_heat_on[0] * self.hvac_p_h) / (self.home_c * self.dt),
             self.temp_in <= self.temp_in_max,
@@ -334,23 +489,26 @@ class MPCCalc:
             self.temp_wh_ev <= self.temp_wh_max,
 
             self.temp_wh == self.temp_wh_init
-                            + 3600 * (((self.temp_in_ev[1] - self.temp_wh_init) / self.wh_r)
+                            + 3600 * (((self.temp_in - self.temp_wh_init) / self.wh_r)
                             + self.wh_heat_on[0] * self.wh_p) / (self.wh_c * self.dt),
             self.temp_wh >= self.temp_wh_min,
             self.temp_wh <= self.temp_wh_max,
 
             self.p_load ==  self.sub_subhourly_steps * (self.hvac_p_c * self.hvac_cool_on + self.hvac_p_h * self.hvac_heat_on + self.wh_p * self.wh_heat_on),
 
-            self.hvac_cool_on <= self.hvac_cool_max,
-            self.hvac_cool_on >= self.hvac_cool_min,
-            self.hvac_heat_on <= self.hvac_heat_max,
-            self.hvac_heat_on >= self.hvac_heat_min,
             self.wh_heat_on <= self.wh_heat_max,
             self.wh_heat_on >= self.wh_heat_min
         ]
-
-        # set total price for electricity
-        self.total_price = cp.Constant(np.array(self.reward_price, dtype=float) + self.base_price[:self.horizon])
+        if self.hvac_cool_max > 0:
+            self.constraints += [
+                self.hvac_cool_on <= self.hvac_cool_max,
+                self.hvac_cool_on >= self.hvac_cool_min
+            ]
+        if self.hvac_heat_max > 0:
+            self.constraints += [
+                self.hvac_heat_on <= self.hvac_heat_max,
+                self.hvac_heat_on >= self.hvac_heat_min
+            ]
 
     def add_battery_constraints(self):
         """
@@ -377,6 +535,8 @@ class MPCCalc:
         Creates the system dynamics for photovoltaic generation. (Using measured GHI.)
         :return: None
         """
+        if not self.pv_on: # p_pv is zero through the night
+            return
         self.constraints += [
             # PV constraints.  GHI provided in W/m2 - convert to kWh
             self.p_pv == self.pv_area * self.pv_eff * cp.multiply(self.ghi_forecast[0:self.horizon], (1 - self.u_pv_curt)) / 1000,
@@ -431,11 +591,10 @@ class MPCCalc:
             self.p_grid == self.p_load + self.sub_subhourly_steps * (self.p_batt_ch + self.p_batt_disch - self.p_pv)
         ]
 
-    def solve_mpc(self):
+    def set_objective(self):
         """
         Sets the objective function of the Home Energy Management System to be the
-        minimization of cost over the MPC time horizon and solves via CVXPY.
-        Used for all home types.
+        minimization of discounted cost over the MPC time horizon.
         :return: None
         """
         self.cost = cp.Variable(self.horizon)
@@ -447,11 +606,515 @@ class MPCCalc:
         self.prob = cp.Problem(self.obj, self.constraints)
         if not self.prob.is_dcp():
             self.log.error("Problem is not DCP")
+
+    @property
+    def template_key(self):
+        """
+        Identifies a problem template: the home, its parameters and HEMS settings
+        (e.g. dt, sub_subhourly_steps, discount_factor) and its season and PV state.
+        :return: tuple
+        """
+        return (self.name, self.template_digest, self.hvac_heat_max > 0, getattr(self, 'pv_on', False))
+
+    @property
+    def template_inputs(self):
+        """
+        :return: list, attributes that change between timesteps and become cvxpy
+        Parameters of a problem template
+        """
+        inputs = ["temp_in_init", "temp_wh_init", "oat_forecast", "oat_actual", "draw_frac", "remainder_frac", "total_price"]
+        if 'pv' in self.type and self.pv_on:
+            inputs += ["ghi_forecast"]
+        if 'battery' in self.type:
+            inputs += ["e_batt_init"]
+        return inputs
+
+    def parametrize_inputs(self):
+        """
+        Replaces the per timestep inputs with cvxpy Parameters so that the problem
+        built from them can be kept as a template and re-solved with new values.
+        :return: None
+        """
+        for name in self.template_inputs:
+            value = getattr(self, name).value
+            setattr(self, name, cp.Parameter(np.shape(value), value=value))
+
+    def load_template(self):
+        """
+        Reuses the problem built for this home in the same season and PV state
+        (cvxpy keeps its compiled form) after updating its inputs. The template's
+        lock is held until release_template, so that a home solved by two threads
+        at once does not overwrite the other's inputs.
+        :return: threading.Lock of the template, acquired, or None if no template
+        was found
+        """
+        with _templates_lock:
+            template = _problem_templates.get(self.template_key)
+            if template is None:
+                return None
+            _problem_templates.move_to_end(self.template_key)
+        lock, attrs = template
+        lock.acquire()
+        for name in self.template_inputs:
+            attrs[name].value = getattr(self, name).value
+        for name, value in attrs.items():
+            setattr(self, name, value)
+        return lock
+
+    def save_template(self):
+        """
+        Keeps the problem just built as a template, evicting the least recently
+        used template if template_cache_size is reached.
+        :return: threading.Lock of the template, acquired
+        """
+        attrs = self.template_inputs + ["constraints", "cost", "obj", "prob", "p_load", "p_grid", "temp_in_ev", "temp_in",
+                                        "temp_wh_ev", "temp_wh", "hvac_cool_on", "hvac_heat_on", "wh_heat_on"]
+        if 'pv' in self.type:
+            attrs += ["p_pv", "u_pv_curt"]
+        if 'battery' in self.type:
+            attrs += ["e_batt", "p_batt_ch", "p_batt_disch"]
+        lock = threading.Lock()
+        lock.acquire()
+        with _templates_lock:
+            if len(_problem_templates) >= self.template_cache_size:
+                _problem_templates.popitem(last=False)
+            _problem_templates[self.template_key] = (lock, {name: getattr(self, name) for name in attrs})
+        return lock
+
+    def release_template(self, lock):
+        """
+        Detaches the home's inputs from the template's Parameters, which the next
+        home to load the template overwrites, and releases the template.
+        :return: None
+        """
+        for name in self.template_inputs:
+            setattr(self, name, cp.Constant(getattr(self, name).value))
+        lock.release()
+
+    def solve_mpc(self):
+        """
+        Solves the MPC problem via CVXPY, unless a stored or cached plan can be used.
+        Used for all home types.
+        :return: None
+        """
+        self.cache_hit = 0
+        self.solve_skipped = 0
+        self.plan_age = 0
+        self.late_solve = 0
+        self.solution = None
+        if len(self.bid_prices) > 0:
+            self.clear_bid_curve()
+        if self.fallback_only:
+            self.status = 'worker_failed' # falls back to the last plan with thermostat overrides
+            return
+        if not self.resolve_due:
+            if not self.use_stored_plan(check_events=False):
+                self.status = 'plan_infeasible' # falls back to the last plan with thermostat overrides
+            return
+        if self.event_triggered and self.use_stored_plan():
+            return
+        if self.cache_size > 0 and self.use_cached_solution():
+            return
+
+        if self.time_remaining() <= 0:
+            self.late_solve = 1
+            self.status = 'out_of_time' # falls back to the last plan with thermostat overrides
+            return
+
+        remaining = self.time_remaining()
+        start = time.time()
         try:
-            self.prob.solve(solver=self.solver, verbose=self.verbose_flag)
+            self.prob.solve(solver=self.solver, verbose=self.verbose_flag, **self.solver_options(remaining))
             self.solved = True
         except:
             self.solved = False
+        self.status = self.prob.status if self.solved else 'solver_error' # a template keeps the status of its last solve, e.g. when GLPK stops an LP at tm_lim
+        proven_optimal = self.status == 'optimal'
+        # GLPK_MI reports a MIP stopped at mip_gap and one stopped by tm_lim alike, only the latter ran out of time
+        timed_out = self.status == 'user_limit' or time.time() - start >= 0.99 * remaining
+        if self.status in ['optimal_inaccurate', 'user_limit'] and self.p_grid.value is not None:
+            self.late_solve = int(timed_out) # take the best incumbent
+            self.status = 'optimal'
+        elif self.status != 'optimal' and timed_out:
+            self.late_solve = 1 # no incumbent, falls back
+
+        if self.status == 'optimal':
+            self.collect_solution()
+            if self.solve_mode == 'lp_round' and not self.round_and_repair():
+                self.status = 'rounding_infeasible'
+                return
+            if self.cache_size > 0 and proven_optimal: # an incumbent stopped by the time limit or gap is not reused
+                get_solution_cache(self.cache_size, self.cache_policy).put(self.cache_key, self.get_plan())
+            if len(self.bid_prices) > 0 and not self.proposal_only:
+                self.solve_bid_curve()
+
+    def time_remaining(self):
+        """
+        Time left for this home to solve, the smaller of solver_time_limit and the
+        time to the deadline of the timestep set by the aggregator.
+        :return: float, seconds (numpy.inf if unlimited)
+        """
+        remaining = self.solver_time_limit if self.solver_time_limit > 0 else np.inf
+        if self.current_values is not None and "deadline" in self.current_values:
+            remaining = min(remaining, float(self.current_values["deadline"]) - time.time())
+        return remaining
+
+    def solver_options(self, remaining=None):
+        """
+        Time limit and relative MIP gap in the form each solver expects.
+        :param remaining: float, seconds the solve may take, None for time_remaining()
+        :return: dictionary of keyword arguments for cvxpy.Problem.solve
+        """
+        options = {}
+        if remaining is None:
+            remaining = self.time_remaining()
+        if self.solver == cp.GLPK_MI:
+            if remaining < np.inf:
+                options["tm_lim"] = max(1, int(1000 * remaining)) # ms
+            if self.solver_mip_gap > 0:
+                options["mip_gap"] = self.solver_mip_gap
+        elif self.solver == cp.GLPK:
+            if remaining < np.inf:
+                options["glpk"] = {"tm_lim": max(1, int(1000 * remaining))} # the LP path of cvxopt only reads options['glpk']
+        elif self.solver == cp.GUROBI:
+            if remaining < np.inf:
+                options["TimeLimit"] = max(0.001, remaining)
+            if self.solver_mip_gap > 0:
+                options["MIPGap"] = self.solver_mip_gap
+        return options
+
+    def collect_solution(self):
+        """
+        Copies the optimal values of the cvxpy problem into self.solution.
+        :return: None
+        """
+        self.solution = {
+            "p_grid": self.p_grid.value,
+            "p_load": self.p_load.value,
+            "temp_in_ev": self.temp_in_ev.value,
+            "temp_in": np.atleast_1d(self.temp_in.value),
+            "temp_wh_ev": self.temp_wh_ev.value,
+            "temp_wh": np.atleast_1d(self.temp_wh.value),
+            "hvac_cool_on": self.hvac_cool_on.value,
+            "hvac_heat_on": self.hvac_heat_on.value,
+            "wh_heat_on": self.wh_heat_on.value,
+            "cost": self.cost.value
+        }
+        if 'pv' in self.type:
+            self.solution["p_pv"] = self.p_pv.value
+            self.solution["u_pv_curt"] = self.u_pv_curt.value
+        if 'battery' in self.type:
+            self.solution["e_batt"] = self.e_batt.value
+            self.solution["p_batt_ch"] = self.p_batt_ch.value
+            self.solution["p_batt_disch"] = self.p_batt_disch.value
+
+    def round_and_repair(self):
+        """
+        Rounds the relaxed HVAC and water heater duty cycles to whole sub-steps,
+        then walks the horizon one timestep at a time and adds or removes a
+        sub-step of duty wherever the rounded plan leaves the comfort bands (the
+        same corrections the fallback in cleanup_and_finish makes).
+        :return: bool, True if the repaired plan is feasible
+        """
+        plan = self.get_plan()
+        for k in ["hvac_cool_on", "hvac_heat_on", "wh_heat_on"]:
+            plan[k] = np.round(plan[k])
+        cool, heat, wh_on = plan["hvac_cool_on"], plan["hvac_heat_on"], plan["wh_heat_on"]
+
+        for t in range(self.horizon):
+            for _ in range(2 * self.sub_subhourly_steps):
+                solution = self.simulate_plan(plan)
+                temp_in = solution["temp_in_ev"][t+1]
+                temp_wh = solution["temp_wh_ev"][t+1]
+                changed = True
+                if temp_in > self.temp_in_max.value and cool[t] < self.hvac_cool_max:
+                    cool[t] += 1
+                elif temp_in > self.temp_in_max.value and heat[t] > self.hvac_heat_min:
+                    heat[t] -= 1
+                elif temp_in < self.temp_in_min.value and heat[t] < self.hvac_heat_max:
+                    heat[t] += 1
+                elif temp_in < self.temp_in_min.value and cool[t] > self.hvac_cool_min:
+                    cool[t] -= 1
+                elif temp_wh < self.temp_wh_min.value and wh_on[t] < self.wh_heat_max:
+                    wh_on[t] += 1
+                elif temp_wh > self.temp_wh_max.value and wh_on[t] > self.wh_heat_min:
+                    wh_on[t] -= 1
+                else:
+                    changed = False
+                if not changed:
+                    break
+
+        solution = self.simulate_plan(plan)
+        if not self.plan_is_feasible(solution):
+            return False
+        self.solution = solution
+        return True
+
+    def get_plan(self):
+        """
+        The decision variables of the current solution, from which simulate_plan
+        can rebuild every other value.
+        :return: dictionary of numpy.ndarray
+        """
+        keys = ["hvac_cool_on", "hvac_heat_on", "wh_heat_on"]
+        if 'pv' in self.type:
+            keys += ["u_pv_curt"]
+        if 'battery' in self.type:
+            keys += ["p_batt_ch", "p_batt_disch"]
+        return {k: np.array(self.solution[k], dtype=float) for k in keys}
+
+    def simulate_plan(self, plan):
+        """
+        Rolls the home's dynamics forward from the current initial conditions
+        under a given plan of decision variables, using the same model as the
+        MPC constraints.
+        :param plan: dictionary of numpy.ndarray, as returned by get_plan
+        :return: dictionary of numpy.ndarray, same keys as self.solution
+        """
+        cool = plan["hvac_cool_on"]
+        heat = plan["hvac_heat_on"]
+        wh_on = plan["wh_heat_on"]
+        oat = np.array(self.oat_current, dtype=float)
+        remainder_frac = self.remainder_frac.value
+        draw_frac = self.draw_frac.value
+        r, c = self.home_r.value, self.home_c.value
+        p_c, p_h = self.hvac_p_c.value, self.hvac_p_h.value
+        wh_r, wh_c, wh_p = self.wh_r.value, self.wh_c.value, self.wh_p.value
+
+        temp_in_ev = np.zeros(self.h_plus)
+        temp_wh_ev = np.zeros(self.h_plus)
+        temp_in_ev[0] = self.temp_in_init.value
+        temp_wh_ev[0] = self.temp_wh_init.value
+        for t in range(self.horizon):
+            temp_in_ev[t+1] = temp_in_ev[t] + 3600 * (((oat[t+1] - temp_in_ev[t]) / r)
+                                - cool[t] * p_c + heat[t] * p_h) / (c * self.dt)
+            mixed = remainder_frac[t+1] * temp_wh_ev[t] + draw_frac[t+1] * self.tap_temp
+            temp_wh_ev[t+1] = mixed + 3600 * (((temp_in_ev[t+1] - mixed) / wh_r)
+                                + wh_on[t] * wh_p) / (wh_c * self.dt)
+        temp_wh = temp_wh_ev[0] + 3600 * (((temp_in_ev[1] - temp_wh_ev[0]) / wh_r)
+                    + wh_on[0] * wh_p) / (wh_c * self.dt)
+
+        p_load = self.sub_subhourly_steps * (p_c * cool + p_h * heat + wh_p * wh_on)
+        solution = {
+            "p_load": p_load,
+            "temp_in_ev": temp_in_ev,
+            "temp_in": temp_in_ev[1:2],
+            "temp_wh_ev": temp_wh_ev,
+            "temp_wh": np.array([temp_wh]),
+            "hvac_cool_on": cool,
+            "hvac_heat_on": heat,
+            "wh_heat_on": wh_on
+        }
+
+        p_grid = p_load
+        if 'pv' in self.type:
+            ghi = np.array(self.ghi_current[:self.horizon], dtype=float)
+            solution["u_pv_curt"] = plan["u_pv_curt"]
+            solution["p_pv"] = self.pv_area.value * self.pv_eff.value * ghi * (1 - plan["u_pv_curt"]) / 1000
+            p_grid = p_grid - self.sub_subhourly_steps * solution["p_pv"]
+        if 'battery' in self.type:
+            e_batt = np.zeros(self.h_plus)
+            e_batt[0] = self.e_batt_init.value
+            for t in range(self.horizon):
+                e_batt[t+1] = e_batt[t] + (self.batt_ch_eff.value * plan["p_batt_ch"][t]
+                                + plan["p_batt_disch"][t] / self.batt_disch_eff.value) / self.dt
+            solution["e_batt"] = e_batt
+            solution["p_batt_ch"] = plan["p_batt_ch"]
+            solution["p_batt_disch"] = plan["p_batt_disch"]
+            p_grid = p_grid + self.sub_subhourly_steps * (plan["p_batt_ch"] + plan["p_batt_disch"])
+
+        solution["p_grid"] = p_grid
+        solution["cost"] = self.total_price.value * p_grid
+        return solution
+
+    def plan_is_feasible(self, solution, tol=1e-4):
+        """
+        Checks a simulated plan against the bounds of the MPC problem.
+        :return: bool
+        """
+        checks = [
+            np.all(solution["temp_in_ev"][1:] >= self.temp_in_min.value - tol),
+            np.all(solution["temp_in_ev"][1:] <= self.temp_in_max.value + tol),
+            np.all(solution["temp_wh_ev"] >= self.temp_wh_min.value - tol),
+            np.all(solution["temp_wh_ev"] <= self.temp_wh_max.value + tol),
+            np.all(solution["hvac_cool_on"] <= self.hvac_cool_max + tol),
+            np.all(solution["hvac_cool_on"] >= self.hvac_cool_min - tol),
+            np.all(solution["hvac_heat_on"] <= self.hvac_heat_max + tol),
+            np.all(solution["hvac_heat_on"] >= self.hvac_heat_min - tol),
+            np.all(solution["wh_heat_on"] <= self.wh_heat_max + tol),
+            np.all(solution["wh_heat_on"] >= self.wh_heat_min - tol)
+        ]
+        if 'battery' in self.type:
+            checks += [
+                np.all(solution["e_batt"][1:] <= self.batt_cap_max.value + tol),
+                np.all(solution["e_batt"][1:] >= self.batt_cap_min.value - tol),
+                np.all(solution["p_batt_ch"] <= self.batt_max_rate.value + tol),
+                np.all(solution["p_batt_ch"] >= -tol),
+                np.all(solution["p_batt_disch"] >= -self.batt_max_rate.value - tol),
+                np.all(solution["p_batt_disch"] <= tol)
+            ]
+        return bool(np.all(checks))
+
+    @property
+    def cache_key(self):
+        """
+        Quantized description of the home, its initial state and its inputs over
+        the horizon. Homes and timesteps with equal keys are expected to share an
+        optimal plan.
+        :return: tuple
+        """
+        def q(x, resolution):
+            return tuple(np.round(np.atleast_1d(np.array(x, dtype=float)) / resolution).astype(int).tolist())
+
+        params = []
+        for subsystem in ["hvac", "wh", "battery", "pv"]:
+            if subsystem in self.home:
+                params += [round(float(v), self.cache_param_decimals) for k, v in sorted(self.home[subsystem].items())
+                            if isinstance(v, (int, float)) and not k in ["temp_in_init", "temp_wh_init", "e_batt_init", "draw_index"]] # the draw schedule is in draw_size
+
+        key = (
+            self.type,
+            tuple(params),
+            q(self.temp_in_init.value, self.cache_temp_resolution),
+            q(self.temp_wh_init.value, self.cache_temp_resolution),
+            self.hvac_heat_max > 0, # season
+            q(self.total_price.value, self.cache_price_resolution),
+            q(self.draw_size, self.cache_draw_resolution)
+        )
+        if 'pv' in self.type:
+            key += (q(self.ghi_current[:self.horizon], 10),)
+        if 'battery' in self.type:
+            key += (q(self.e_batt_init.value, 0.1),)
+        return key
+
+    def use_stored_plan(self, check_events=True):
+        """
+        Event-triggered MPC. Keeps executing the plan from the last solve, shifted
+        by one timestep, unless the last step fell back (its plan is not aligned
+        with this step), the realized state has drifted from the plan's
+        prediction, the prices or water draws over the rest of the plan have changed,
+        the plan is older than event_max_age, or the shifted plan is infeasible.
+        :param check_events: bool, False to commit to the plan regardless of drift
+        (used by resolve_every) as long as it has steps left and remains feasible
+        :return: bool, True if the stored plan was used in place of a solve
+        """
+        prev = self.prev_optimal_vals
+        if self.timestep == 0 or prev is None or not "plan_age" in prev:
+            return False
+        if int(float(prev.get("solve_counter", 0))) > 0: # the last step fell back, its stored plan is from an earlier step
+            return False
+
+        age = int(float(prev["plan_age"])) + 1
+        max_age = self.event_max_age if check_events else self.horizon - 1
+        if age > max_age or self.horizon < 2:
+            return False
+
+        if check_events and not self.plan_is_current(prev):
+            return False
+
+        plan = {}
+        scale = {"hvac_cool_on_opt": self.sub_subhourly_steps, "hvac_heat_on_opt": self.sub_subhourly_steps, "wh_heat_on_opt": self.sub_subhourly_steps}
+        fields = {"hvac_cool_on": "hvac_cool_on_opt", "hvac_heat_on": "hvac_heat_on_opt", "wh_heat_on": "wh_heat_on_opt"}
+        if 'pv' in self.type:
+            fields["u_pv_curt"] = "u_pv_curt_opt"
+        if 'battery' in self.type:
+            fields["p_batt_ch"] = "p_batt_ch"
+            fields["p_batt_disch"] = "p_batt_disch"
+        for k, field in fields.items():
+            values = [float(prev[f"{field}_{j}"]) * scale.get(field, 1) for j in range(1, self.horizon)]
+            plan[k] = np.array(values + values[-1:]) # hold the last decision to fill the horizon
+
+        solution = self.simulate_plan(plan)
+        if not self.plan_is_feasible(solution):
+            return False
+
+        self.solution = solution
+        self.status = 'optimal'
+        self.solve_skipped = 1
+        self.plan_age = age
+        return True
+
+    def plan_is_current(self, prev):
+        """
+        Checks the stored plan against the realized state and the latest forecasts.
+        :param prev: dictionary, the home's values from the previous timestep
+        :return: bool
+        """
+        if not "price_opt_0" in prev:
+            return False
+
+        # realized state against the state predicted by the plan
+        if abs(float(prev["temp_in_ev_opt_0"]) - self.temp_in_init.value) > self.event_temp_tol:
+            return False
+        if abs(float(prev["temp_wh_ev_opt_0"]) - self.temp_wh_init.value) > self.event_temp_tol:
+            return False
+
+        # inputs over the remainder of the plan
+        n = self.horizon - 1
+        prev_price = np.array([float(prev[f"price_opt_{j}"]) for j in range(1, self.horizon)])
+        if np.max(np.abs(prev_price - self.total_price.value[:n])) > self.event_price_tol:
+            return False
+        prev_draws = np.array([float(prev[f"waterdraws_{j}"]) for j in range(1, self.horizon)])
+        if np.max(np.abs(prev_draws - np.array(self.draw_size[:n]))) > self.event_draw_tol:
+            return False
+        return True
+
+    def use_cached_solution(self):
+        """
+        Looks up a stored plan for the current key and, if it is feasible from the
+        actual initial conditions and inputs, uses it in place of a solve.
+        :return: bool, True if a cached plan was used
+        """
+        cache = get_solution_cache(self.cache_size, self.cache_policy)
+        plan = cache.get(self.cache_key)
+        if plan is None:
+            return False
+
+        solution = self.simulate_plan(plan)
+        if not self.plan_is_feasible(solution):
+            cache.reject()
+            return False
+
+        self.solution = solution
+        self.status = 'optimal'
+        self.cache_hit = 1
+        return True
+
+    def clear_bid_curve(self):
+        """
+        Marks every bid as unsolved, the home's bid curve then follows its actual
+        grid load (see parse_bid_curve) on the steps without a solve, e.g. a cache
+        hit, a stored plan or the fallback controller.
+        :return: None
+        """
+        for i, rp in enumerate(self.bid_prices):
+            self.optimal_vals[f"bid_price_{i}"] = rp
+            self.optimal_vals[f"bid_p_grid_{i}"] = np.nan
+        self.optimal_vals["n_bids"] = len(self.bid_prices)
+
+    def solve_bid_curve(self):
+        """
+        Re-solves the MPC problem for each candidate reward price in bid_prices and
+        records the first timestep grid load of each solve, giving a piecewise
+        linear load vs. reward price curve for this home. Called once the solve
+        with the actual reward price is collected, with the time it left; the
+        bids that do not fit are left unsolved.
+        :return: None
+        """
+        actual_price = self.total_price.value
+        for i, rp in enumerate(self.bid_prices):
+            remaining = self.time_remaining()
+            if remaining <= 0:
+                break
+            self.total_price.value = np.full(len(self.reward_price), rp) + self.base_price[:self.horizon]
+            try:
+                self.prob.solve(solver=self.solver, verbose=self.verbose_flag, **self.solver_options(remaining))
+                solved = self.prob.status in ['optimal', 'optimal_inaccurate', 'user_limit'] and self.p_grid.value is not None
+            except:
+                solved = False
+            if solved:
+                self.optimal_vals[f"bid_p_grid_{i}"] = self.p_grid.value[0] / self.sub_subhourly_steps
+        self.total_price.value = actual_price
 
     def implement_presolve(self):
         constraints = [
@@ -483,32 +1146,35 @@ class MPCCalc:
 
         i = 0
         while i < 1:
-            if self.prob.status == 'optimal': # if the problem has been solved
+            if self.status == 'optimal': # if the problem has been solved
                 self.counter = 0
                 self.timestep += 1
                 self.stored_optimal_vals = defaultdict()
-                self.stored_optimal_vals["p_grid_opt"] = (self.p_grid.value / self.sub_subhourly_steps).tolist()
-                self.stored_optimal_vals["forecast_p_grid_opt"] = (self.p_grid.value[1:] / self.sub_subhourly_steps).tolist() + [0]
-                self.stored_optimal_vals["p_load_opt"] = (self.p_load.value / self.sub_subhourly_steps).tolist()
-                self.stored_optimal_vals["temp_in_ev_opt"] = (self.temp_in_ev.value[1:]).tolist()
-                self.stored_optimal_vals["temp_in_opt"] = self.temp_in.value.tolist()
-                self.stored_optimal_vals["temp_wh_ev_opt"] = (self.temp_wh_ev.value[1:]).tolist()
-                self.stored_optimal_vals["temp_wh_opt"] = self.temp_wh.value.tolist()
-                self.stored_optimal_vals["hvac_cool_on_opt"] = (self.hvac_cool_on.value / self.sub_subhourly_steps).tolist()
-                self.stored_optimal_vals["hvac_heat_on_opt"] = (self.hvac_heat_on.value / self.sub_subhourly_steps).tolist()
-                self.stored_optimal_vals["wh_heat_on_opt"] = (self.wh_heat_on.value / self.sub_subhourly_steps).tolist()
-                self.stored_optimal_vals["cost_opt"] = (self.cost.value).tolist()
+                self.stored_optimal_vals["p_grid_opt"] = (self.solution["p_grid"] / self.sub_subhourly_steps).tolist()
+                self.stored_optimal_vals["forecast_p_grid_opt"] = (self.solution["p_grid"][1:] / self.sub_subhourly_steps).tolist() + [0]
+                self.stored_optimal_vals["p_load_opt"] = (self.solution["p_load"] / self.sub_subhourly_steps).tolist()
+                self.stored_optimal_vals["temp_in_ev_opt"] = (self.solution["temp_in_ev"][1:]).tolist()
+                self.stored_optimal_vals["temp_in_opt"] = self.solution["temp_in"].tolist()
+                self.stored_optimal_vals["temp_wh_ev_opt"] = (self.solution["temp_wh_ev"][1:]).tolist()
+                self.stored_optimal_vals["temp_wh_opt"] = self.solution["temp_wh"].tolist()
+                self.stored_optimal_vals["hvac_cool_on_opt"] = (self.solution["hvac_cool_on"] / self.sub_subhourly_steps).tolist()
+                self.stored_optimal_vals["hvac_heat_on_opt"] = (self.solution["hvac_heat_on"] / self.sub_subhourly_steps).tolist()
+                self.stored_optimal_vals["wh_heat_on_opt"] = (self.solution["wh_heat_on"] / self.sub_subhourly_steps).tolist()
+                self.stored_optimal_vals["cost_opt"] = (self.solution["cost"]).tolist()
                 self.stored_optimal_vals["waterdraws"] = self.draw_size
+                if self.event_triggered:
+                    self.stored_optimal_vals["price_opt"] = self.total_price.value.tolist()
+                    opt_keys.add("price_opt")
                 self.all_optimal_vals = {}
 
                 if 'pv' in self.type:
-                    self.stored_optimal_vals['p_pv_opt'] = (self.p_pv.value).tolist()
-                    self.stored_optimal_vals['u_pv_curt_opt'] = (self.u_pv_curt.value).tolist()
+                    self.stored_optimal_vals['p_pv_opt'] = (self.solution["p_pv"]).tolist()
+                    self.stored_optimal_vals['u_pv_curt_opt'] = (self.solution["u_pv_curt"]).tolist()
                     opt_keys.update(['p_pv_opt', 'u_pv_curt_opt'])
                 if 'battery' in self.type:
-                    self.stored_optimal_vals['e_batt_opt'] = (self.e_batt.value).tolist()[1:]
-                    self.stored_optimal_vals['p_batt_ch'] = (self.p_batt_ch.value).tolist()
-                    self.stored_optimal_vals['p_batt_disch'] = (self.p_batt_disch.value).tolist()
+                    self.stored_optimal_vals['e_batt_opt'] = (self.solution["e_batt"]).tolist()[1:]
+                    self.stored_optimal_vals['p_batt_ch'] = (self.solution["p_batt_ch"]).tolist()
+                    self.stored_optimal_vals['p_batt_disch'] = (self.solution["p_batt_disch"]).tolist()
                     opt_keys.update(['p_batt_ch', 'p_batt_disch', 'e_batt_opt'])
 
                 for k in opt_keys:
@@ -522,13 +1188,21 @@ class MPCCalc:
                 self.optimal_vals["temp_in_opt"] = self.stored_optimal_vals["temp_in_opt"][0]
                 self.optimal_vals["correct_solve"] = 1
                 self.optimal_vals["solve_counter"] = 0
-                self.log.debug(f"MPC solved with status {self.prob.status} for {self.name}")
+                self.optimal_vals["cache_hit"] = self.cache_hit
+                self.optimal_vals["solve_skipped"] = self.solve_skipped
+                self.optimal_vals["plan_age"] = self.plan_age
+                self.optimal_vals["late_solve"] = self.late_solve
+                self.log.debug(f"MPC solved with status {self.status} for {self.name}")
                 return
             else:
                 # self.implement_presolve()
                 self.counter += 1
                 self.log.warning(f"Unable to solve for house {self.name}. Reverting to optimal solution from last feasible timestep, t-{self.counter}.")
                 self.optimal_vals["correct_solve"] = 0
+                self.optimal_vals["cache_hit"] = 0
+                self.optimal_vals["solve_skipped"] = 0
+                self.optimal_vals["plan_age"] = 0
+                self.optimal_vals["late_solve"] = self.late_solve
 
                 if self.counter < self.horizon and self.timestep > 0:
                     for k in opt_keys:
@@ -618,7 +1292,7 @@ class MPCCalc:
         the base price set by the utility.
         :return: None
         """
-        self.current_values = self.redis_client.conn.hgetall("current_values")
+        self.current_values = self.redis_client.conn.hgetall(self.redis_client.key("current_values"))
 
     def cast_redis_timestep(self):
         """
@@ -632,8 +1306,8 @@ class MPCCalc:
         Casts the reward price signal values for the current timestep.
         :return: None
         """
-        rp = self.redis_client.conn.lrange('reward_price', 0, -1)
-        self.reward_price = rp[:self.horizon]
+        rp = self.redis_client.conn.lrange(self.redis_client.key('reward_price'), 0, -1)
+        self.reward_price = rp[:self.horizon] + [0] * (self.horizon - len(rp)) # no forecast beyond the action horizon
         self.log.info(f"ts: {self.timestep}; RP: {self.reward_price[0]}")
 
     def solve_type_problem(self):
@@ -642,8 +1316,26 @@ class MPCCalc:
         :return: None
         """
         self.set_environmental_variables()
+        self.set_operating_mode()
+        if self.fallback_only or not self.resolve_due: # no solve, the stored plan and fallback only simulate the home
+            self.solve_mpc()
+            return
+        if self.template_cache_size > 0:
+            lock = self.load_template()
+            if lock is None:
+                self.parametrize_inputs()
+                self.add_type_constraints()
+                self.set_type_p_grid()
+                self.set_objective()
+                lock = self.save_template()
+            try:
+                self.solve_mpc()
+            finally:
+                self.release_template(lock)
+            return
         self.add_type_constraints()
         self.set_type_p_grid()
+        self.set_objective()
         self.solve_mpc()
 
     def run_home(self):
@@ -658,6 +1350,7 @@ class MPCCalc:
         self.log = pathos.logger(level=logging.INFO, handler=fh, name=self.name)
 
         self.redis_client = RedisClient()
+        self.redis_client.namespace = self.namespace
         self.redis_get_initial_values()
         self.cast_redis_timestep()
 
@@ -666,7 +1359,18 @@ class MPCCalc:
 
         self.get_initial_conditions()
         self.solve_type_problem()
+        if self.proposal_only:
+            if self.status == 'optimal' and self.solution is not None:
+                self.proposal = (np.array(self.solution["p_grid"], dtype=float) / self.sub_subhourly_steps).tolist()
+            else: # the fallback controller does not respond to prices
+                self.cleanup_and_finish()
+                self.proposal = [float(self.optimal_vals["p_grid_opt"])] * self.horizon
+            self.log.removeHandler(fh)
+            return
         self.cleanup_and_finish()
         self.redis_write_optimal_vals()
+        if self.cache_size > 0:
+            cache = get_solution_cache(self.cache_size, self.cache_policy)
+            self.redis_client.conn.hset(self.redis_client.key("solution_cache"), os.getpid(), json.dumps(cache.stats()))
 
         self.log.removeHandler(fh)
@@ -1,5 +1,9 @@
 import os
+import re
 import redis
+import threading
+
+_deferred = threading.local() # writes of the task run by the current thread, see RedisClient.defer_writes
 
 class Singleton(type):
 
@@ -13,7 +17,8 @@ class Singleton(type):
 class RedisClient(metaclass=Singleton):
 
     def __init__(self):
-        self.pool = redis.ConnectionPool(host = os.environ.get('REDIS_HOST', 'localhost'), decode_responses = True, db = 0)
+        self.pool = redis.ConnectionPool(host = os.environ.get('REDIS_HOST', 'localhost'), decode_responses = True, db = int(os.environ.get('REDIS_DB', 0)))
+        self.namespace = os.environ.get('REDIS_NAMESPACE', '') # prefix of every key of this simulation
 
     @property
     def conn(self):
@@ -23,3 +28,62 @@ class RedisClient(metaclass=Singleton):
 
     def getConnection(self):
         self._conn = redis.Redis(connection_pool = self.pool)
+
+    def key(self, name):
+        """
+        :param name: str, key within the simulation (e.g. "GHI" or a home name)
+        :return: str, the redis key in this client's namespace
+        """
+        if self.namespace:
+            return f"{self.namespace}:{name}"
+        return name
+
+    def defer_writes(self):
+        """
+        Makes write collect the commands of the current thread instead of sending
+        them, until pop_writes.
+        :return: None
+        """
+        _deferred.writes = []
+
+    def pop_writes(self):
+        """
+        Stops deferring the writes of the current thread.
+        :return: list of tuples (command, args, kwargs) collected since defer_writes
+        """
+        writes = getattr(_deferred, "writes", None)
+        _deferred.writes = None
+        return writes if writes is not None else []
+
+    def write(self, command, *args, pipe=None, **kwargs):
+        """
+        Sends a command that changes the simulation's state (e.g. a home's hash),
+        on pipe if given. While deferred (see defer_writes) the command is only
+        collected, and the worker sends it with the task's result if the task was
+        not given to another worker in the meantime.
+        :param command: str, redis command, a method of redis.Redis
+        :return: None
+        """
+        if getattr(_deferred, "writes", None) is not None:
+            _deferred.writes.append((command, args, kwargs))
+        else:
+            getattr(pipe if pipe is not None else self.conn, command)(*args, **kwargs)
+
+    def flush(self):
+        """
+        Deletes every key of the namespace, or the whole database when there is
+        no namespace. Other simulations sharing the server are left untouched.
+        :return: None
+        """
+        if not self.namespace:
+            self.conn.flushdb()
+            return
+        pattern = re.sub(r'([*?\[\]\\])', r'\\\1', self.namespace) # the namespace is matched literally, e.g. a sweep version with a list value
+        batch = []
+        for k in self.conn.scan_iter(match=f"{pattern}:*", count=1000):
+            batch.append(k)
+            if len(batch) >= 1000:
+                self.conn.unlink(*batch)
+                batch = []
+        if len(batch) > 0:
+            self.conn.unlink(*batch)
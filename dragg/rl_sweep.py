@@ -0,0 +1,271 @@
+import os
+import itertools as it
+import numpy as np
+import pandas as pd
+from prettytable import PrettyTable
+
+# Local
+from dragg.logger import Logger
+
+class RLSweep:
+    """
+    Trains K copies of the RLAgent actor-critic at once against the simplified
+    (linear) community response model used by Aggregator.test_response. The
+    policy (theta_mu) and critic (theta_q) weights of every agent are stacked
+    into arrays so that one numpy step advances all K agents. As in RLAgent, the
+    actions are drawn around the unclipped policy mean and only the mean in the
+    actor update is clipped, here to [-max_rp, max_rp] (RLAgent's action_space).
+    """
+    def __init__(self, config, dt):
+        self.log = Logger("rl_sweep")
+        self.config = config
+        self.dt = dt
+        self.sweep_config = self.config['agg']['rl']['sweep']
+        self.n_steps = int(self.sweep_config.get('n_steps', 24 * self.dt * 30))
+        self.prev_timesteps = int(self.config['agg']['rl']['prev_timesteps'])
+        self.max_rp = float(self.config['agg']['rl']['max_rp'])
+        self.response_rate = float(self.config['agg']['simplified']['response_rate'])
+        self.lam_theta = 0.01 # matches RLAgent.lam_theta
+        self.ridge_alpha = 0.01 # matches the Ridge regression in RLAgent.update_qfunction
+        self.rng = np.random.default_rng(self.config['simulation']['random_seed'])
+
+        self.permutations = self.set_permutations()
+        self.k = len(self.permutations)
+        self.results = None
+
+    def set_permutations(self):
+        """
+        Expands the lists of hyperparameters in [agg.rl.sweep] into every combination.
+        :return: list of dictionaries
+        """
+        parameters = {
+            "alpha": [float(i) for i in self.sweep_config['alpha']],
+            "beta": [float(i) for i in self.sweep_config['beta']],
+            "epsilon": [float(i) for i in self.sweep_config['epsilon']],
+            "batch_size": [int(i) for i in self.sweep_config['batch_size']],
+            "twin_q": [bool(i) for i in self.sweep_config.get('twin_q', [False])]
+        }
+        keys, values = zip(*parameters.items())
+        return [dict(zip(keys, v)) for v in it.product(*values)]
+
+    def state_basis(self, fcst_error, forecast_trend, time_of_day):
+        """
+        Vectorized RLAgent.state_basis for K agents.
+        :return: numpy.ndarray, shape (K, 23)
+        """
+        forecast_error_basis = self._quadratic_basis(fcst_error)
+        forecast_trend_basis = self._quadratic_basis(forecast_trend)
+        time_basis = self._time_basis(time_of_day, len(fcst_error))
+
+        phi = self._outer(forecast_error_basis, forecast_trend_basis)
+        return self._outer(phi, time_basis)
+
+    def state_action_basis(self, fcst_error, forecast_trend, time_of_day, delta_action, action):
+        """
+        Vectorized RLAgent.state_action_basis for K agents (or K * batch experiences).
+        :return: numpy.ndarray, shape (n, 71)
+        """
+        action_basis = self._quadratic_basis(action)
+        delta_action_basis = self._quadratic_basis(delta_action)
+        time_basis = self._time_basis(time_of_day, len(action))
+        forecast_error_basis = self._quadratic_basis(fcst_error)
+        forecast_trend_basis = self._quadratic_basis(forecast_trend)
+
+        v = self._outer(forecast_trend_basis, action_basis)
+        w = self._outer(forecast_error_basis, action_basis)
+        z = self._outer(forecast_error_basis, delta_action_basis)
+        phi = np.concatenate((v, w, z), axis=1)
+        return self._outer(phi, time_basis)
+
+    def _quadratic_basis(self, x):
+        return np.stack((np.ones_like(x), x, x**2), axis=1)
+
+    def _time_basis(self, time_of_day, n):
+        tod = np.broadcast_to(time_of_day, (n,))
+        return np.stack((np.ones(n), np.sin(2 * np.pi * tod), np.cos(2 * np.pi * tod)), axis=1)
+
+    def _outer(self, a, b):
+        """
+        Row-wise equivalent of np.outer(a, b).flatten()[1:]
+        """
+        return np.einsum('ki,kj->kij', a, b).reshape(a.shape[0], -1)[:, 1:]
+
+    def run(self):
+        """
+        Steps all K agents against the simplified community response model
+        for n_steps timesteps.
+        :return: None
+        """
+        k = self.k
+        self.log.logger.info(f"Training {k} RL agents against the simplified response model for {self.n_steps} timesteps.")
+
+        alpha = np.array([p['alpha'] for p in self.permutations])
+        beta = np.array([p['beta'] for p in self.permutations])
+        sigma = np.array([p['epsilon'] for p in self.permutations])
+        batch_size = np.array([p['batch_size'] for p in self.permutations])
+        twin_q = np.array([p['twin_q'] for p in self.permutations])
+        alpha_r = alpha * (2 ** 2)
+
+        init_load = self.config['community']['house_p_avg'] * self.config['community']['total_number_homes']
+        tracked_loads = init_load * np.ones((k, self.prev_timesteps))
+        setpoint = tracked_loads.mean(axis=1)
+        agg_load = setpoint + 0.1 * setpoint
+        prev_agg_load = agg_load.copy()
+
+        theta_mu = np.zeros((k, 23))
+        theta_q = self.rng.normal(0, 0.3, (k, 71, 2)) # second critic only read by twin_q agents
+        z_theta_mu = np.zeros((k, 23))
+        average_reward = np.zeros(k)
+        cumulative_reward = np.zeros(k)
+
+        # replay memory, one row per agent
+        mem_state = np.zeros((k, self.n_steps, 4)) # fcst_error, forecast_trend, time_of_day, delta_action
+        mem_next_state = np.zeros((k, self.n_steps, 4))
+        mem_action = np.zeros((k, self.n_steps))
+        mem_reward = np.zeros((k, self.n_steps))
+
+        rewards = np.zeros((k, self.n_steps))
+        errors = np.zeros((k, self.n_steps))
+
+        state = None
+        action = np.zeros(k)
+        prev_action = np.zeros(k)
+        rows = np.arange(k)
+        for t in range(self.n_steps):
+            # environment step, as in Aggregator.test_response
+            prev_agg_load = agg_load
+            agg_load = agg_load - self.response_rate * action * (setpoint - agg_load)
+            tracked_loads[:, :-1] = tracked_loads[:, 1:]
+            tracked_loads[:, -1] = agg_load
+            setpoint = tracked_loads.mean(axis=1)
+
+            time_of_day = (t % (24 * self.dt)) / (24 * self.dt)
+            next_state = np.stack((
+                (agg_load - setpoint) / setpoint,
+                (agg_load - prev_agg_load) / setpoint,
+                time_of_day * np.ones(k),
+                action - prev_action
+            ), axis=1)
+            if state is None:
+                state = next_state
+
+            r = -next_state[:, 0]**2
+            i = np.where(twin_q, (t + 1) % 2, 0) # RLAgent toggles its critic head before the first update
+
+            xu_k = self.state_action_basis(state[:, 0], state[:, 1], state[:, 2], state[:, 3], action)
+            x_k1 = self.state_basis(next_state[:, 0], next_state[:, 1], next_state[:, 2])
+            next_action = np.einsum('kn,kn->k', theta_mu, x_k1) + sigma * self.rng.standard_normal(k) # RLAgent.get_policy_action
+            xu_k1 = self.state_action_basis(next_state[:, 0], next_state[:, 1], next_state[:, 2], next_state[:, 3], next_action)
+
+            mem_state[:, t] = state
+            mem_next_state[:, t] = next_state
+            mem_action[:, t] = action
+            mem_reward[:, t] = r
+
+            # critic update
+            q_head = theta_q[rows, :, i]
+            q_predicted = np.einsum('kn,kn->k', q_head, xu_k)
+            q_observed = r + beta * np.einsum('kn,kn->k', q_head, xu_k1)
+            self.update_qfunction(theta_q, i, t + 1, alpha, beta, sigma, batch_size, twin_q, theta_mu,
+                                mem_state, mem_next_state, mem_action, mem_reward)
+
+            # actor update
+            x_k = self.state_basis(state[:, 0], state[:, 1], state[:, 2])
+            delta = np.clip(q_predicted - q_observed, -1, 1)
+            average_reward += alpha_r * delta
+            cumulative_reward += r
+            mu = np.clip(np.einsum('kn,kn->k', theta_mu, x_k), -self.max_rp, self.max_rp)
+            grad_pi_mu = ((sigma**2) * (action - mu))[:, None] * x_k
+            z_theta_mu = self.lam_theta * z_theta_mu + grad_pi_mu
+            theta_mu += (alpha * delta)[:, None] * z_theta_mu
+
+            rewards[:, t] = r
+            errors[:, t] = next_state[:, 0]
+
+            state = next_state
+            prev_action = action
+            action = next_action
+
+        self.theta_mu = theta_mu
+        self.theta_q = theta_q
+        self.summarize(rewards, errors, cumulative_reward)
+
+    def update_qfunction(self, theta_q, i, n_mem, alpha, beta, sigma, batch_size, twin_q, theta_mu,
+                        mem_state, mem_next_state, mem_action, mem_reward):
+        """
+        Experience replay update of the critic for every agent whose memory is
+        larger than its batch size. Batches are padded to the largest batch size
+        and masked so that each agent fits its ridge regression on exactly
+        batch_size distinct experiences.
+        :return: None
+        """
+        active = n_mem > batch_size
+        if not np.any(active):
+            return
+
+        ks = np.flatnonzero(active)
+        n_batch = int(np.max(batch_size[ks]))
+        # without replacement, as random.sample in RLAgent: the batch_size smallest of a random key per experience
+        keys = self.rng.random((len(ks), n_mem))
+        idx = np.argpartition(keys, n_batch - 1, axis=1)[:, :n_batch]
+        idx = np.take_along_axis(idx, np.argsort(np.take_along_axis(keys, idx, axis=1), axis=1), axis=1)
+        mask = (np.arange(n_batch)[None, :] < batch_size[ks, None]).astype(float)
+
+        s = mem_state[ks[:, None], idx].reshape(-1, 4)
+        s1 = mem_next_state[ks[:, None], idx].reshape(-1, 4)
+        u = mem_action[ks[:, None], idx].reshape(-1)
+        r = mem_reward[ks[:, None], idx]
+
+        # target uses a fresh policy action for the next state, as RLAgent.process_exp
+        theta_mu_b = np.repeat(theta_mu[ks], n_batch, axis=0)
+        x1 = self.state_basis(s1[:, 0], s1[:, 1], s1[:, 2])
+        u1 = np.einsum('kn,kn->k', theta_mu_b, x1) + np.repeat(sigma[ks], n_batch) * self.rng.standard_normal(len(x1))
+        xu1 = self.state_action_basis(s1[:, 0], s1[:, 1], s1[:, 2], s1[:, 3], u1).reshape(len(ks), n_batch, -1)
+        q1 = np.einsum('kbn,knm->kbm', xu1, theta_q[ks])
+        q_k1 = np.where(twin_q[ks, None], q1.min(axis=2), q1[:, :, 0])
+        y = r + beta[ks, None] * q_k1
+
+        phi = self.state_action_basis(s[:, 0], s[:, 1], s[:, 2], s[:, 3], u).reshape(len(ks), n_batch, -1)
+
+        # weighted ridge regression with a fitted (and discarded) intercept, as sklearn.Ridge
+        w = mask / mask.sum(axis=1, keepdims=True)
+        phi_c = phi - np.einsum('kb,kbn->kn', w, phi)[:, None, :]
+        y_c = y - np.einsum('kb,kb->k', w, y)[:, None]
+        a = np.einsum('kbn,kb,kbm->knm', phi_c, mask, phi_c) + self.ridge_alpha * np.eye(phi.shape[2])
+        b = np.einsum('kbn,kb,kb->kn', phi_c, mask, y_c)
+        coef = np.linalg.solve(a, b[:, :, None])[:, :, 0]
+
+        head = i[ks]
+        theta_q[ks, :, head] = alpha[ks, None] * coef + (1 - alpha[ks, None]) * theta_q[ks, :, head]
+
+    def summarize(self, rewards, errors, cumulative_reward):
+        """
+        Ranks the agents by their cumulative reward. The setpoint of the simplified
+        model is the rolling mean of the load, so every agent's tracking error
+        decays to zero and only the transient tells the agents apart.
+        :return: None
+        """
+        window = max(1, self.n_steps // 10)
+        self.results = pd.DataFrame(self.permutations)
+        self.results["final_avg_reward"] = rewards[:, -window:].mean(axis=1)
+        self.results["cumulative_reward"] = cumulative_reward
+        self.results["final_rmse_error"] = np.sqrt(np.mean(errors[:, -window:]**2, axis=1))
+        self.results["max_abs_error"] = np.abs(errors).max(axis=1)
+        self.results = self.results.sort_values(["cumulative_reward", "max_abs_error"], ascending=[False, True]).reset_index(drop=True)
+        self.results.index.name = "rank"
+
+    def write_results(self, output_dir, n_show=10):
+        """
+        Writes the ranked results table to csv and logs the top agents.
+        :return: None
+        """
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        file = os.path.join(output_dir, "rl_sweep-results.csv")
+        self.results.to_csv(file)
+
+        table = PrettyTable(["rank"] + self.results.columns.to_list())
+        for rank, row in self.results.head(n_show).iterrows():
+            table.add_row([rank] + row.to_list())
+        self.log.logger.info(f"Top {min(n_show, self.k)} of {self.k} agents:\n{table}")
+        self.log.logger.info(f"Wrote ranked results for {self.k} agents to {file}")
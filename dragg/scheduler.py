@@ -0,0 +1,74 @@
+import numpy as np
+
+# Relative solve cost of the home types (number of variables) used to order homes
+# that have no solve time history yet
+TYPE_PRIORITY = {"pv_battery": 3, "battery_only": 2, "pv_only": 1, "base": 0}
+
+class SolveScheduler:
+    """
+    Orders the homes sent to the solver pool longest expected solve first, so that
+    the slow (pv_battery, near comfort bound) homes start before the pool runs out
+    of work. Expected solve times are an exponentially weighted moving average of
+    each home's recent solves. Also tracks the makespan of each dispatch and the
+    busy time of each worker process.
+    """
+    def __init__(self, smoothing=0.3):
+        """
+        :param smoothing: float, weight of the latest solve time in the moving average
+        """
+        self.smoothing = smoothing
+        self.estimates = {} # home name: expected solve time (s)
+        self.types = {} # home name: home type
+        self.makespans = []
+        self.ideal_makespans = [] # lower bound with perfect balancing, max(longest solve, total / workers)
+        self.busy = {} # worker pid: total solve time (s)
+
+    def estimate(self, home):
+        """
+        :return: float, expected solve time (s) of an MPCCalc home, from its own
+        history or else the average of known homes of its type
+        """
+        if home.name in self.estimates:
+            return self.estimates[home.name]
+        same_type = [v for k, v in self.estimates.items() if self.types[k] == home.type]
+        return float(np.mean(same_type)) if len(same_type) > 0 else 0.0
+
+    def order(self, homes):
+        """
+        :param homes: list of MPCCalc objects
+        :return: list of the homes, longest expected solve first
+        """
+        return sorted(homes, key=lambda home: (self.estimate(home), TYPE_PRIORITY.get(home.type, 0)), reverse=True)
+
+    def update(self, homes, results, makespan, n_workers):
+        """
+        :param homes: list of the dispatched MPCCalc objects
+        :param results: list of dictionaries returned by manage_home
+        :param makespan: float, wall time of the dispatch (s)
+        :return: None
+        """
+        for home in homes:
+            self.types[home.name] = home.type
+        solve_times = []
+        for r in results:
+            if r is None:
+                continue
+            prev = self.estimates.get(r["name"])
+            self.estimates[r["name"]] = r["solve_time"] if prev is None else self.smoothing * r["solve_time"] + (1 - self.smoothing) * prev
+            self.busy[r["pid"]] = self.busy.get(r["pid"], 0) + r["solve_time"]
+            solve_times.append(r["solve_time"])
+        if len(solve_times) > 0:
+            self.makespans.append(makespan)
+            self.ideal_makespans.append(max(max(solve_times), sum(solve_times) / n_workers))
+
+    def summary(self):
+        """
+        :return: dictionary of makespan and per worker utilization metrics
+        """
+        total = sum(self.makespans)
+        return {
+            "mean_makespan": float(np.mean(self.makespans)) if len(self.makespans) > 0 else 0.0,
+            "max_makespan": float(max(self.makespans, default=0)),
+            "makespan_efficiency": float(sum(self.ideal_makespans) / total) if total > 0 else 0.0,
+            "workers": {str(pid): {"busy_time": t, "utilization": t / total if total > 0 else 0.0} for pid, t in self.busy.items()}
+        }
@@ -0,0 +1,69 @@
+import json
+import numpy as np
+
+# Local
+from dragg.redis_client import RedisClient
+
+def parse_bid_curve(vals, bid_prices):
+    """
+    Reads one home's load vs. reward price curve from its redis values. Candidate
+    prices that the home failed to solve take its actual grid load.
+    :param vals: dictionary, the home's redis hash
+    :param bid_prices: numpy.ndarray, candidate reward prices
+    :return: numpy.ndarray, load at each of the bid_prices
+    """
+    if int(float(vals.get("n_bids", 0))) != len(bid_prices):
+        return float(vals["p_grid_opt"]) * np.ones(len(bid_prices))
+    loads = np.array([float(vals[f"bid_p_grid_{i}"]) for i in range(len(bid_prices))])
+    return np.where(np.isnan(loads), float(vals["p_grid_opt"]), loads)
+
+class Shard:
+    """
+    A group of homes (e.g. a feeder) reduced by a sub-aggregator. Each timestep
+    a worker reads the shard's homes from redis in one pipeline, sums their loads,
+    costs and bid curves, and appends each home's values to its history list in
+    redis, so that the root aggregator only handles one partial aggregate per shard.
+    """
+    def __init__(self, shard_id, homes, bid_prices, namespace=''):
+        """
+        :param homes: list of tuples (home name, weight, list of the keys to keep
+        in the home's history)
+        :param bid_prices: numpy.ndarray, candidate reward prices of the bid curves
+        :param namespace: str, redis namespace of the simulation
+        """
+        self.id = shard_id
+        self.homes = homes
+        self.bid_prices = bid_prices
+        self.namespace = namespace
+
+def reduce_shard(shard):
+    """
+    Top level function (picklizable by pathos) reducing one shard at the current timestep.
+    :return: dictionary of the shard's partial aggregates
+    """
+    redis_client = RedisClient()
+    redis_client.namespace = shard.namespace
+    pipe = redis_client.conn.pipeline(transaction=False)
+    for name, _, _ in shard.homes:
+        pipe.hgetall(redis_client.key(name))
+    all_vals = pipe.execute()
+
+    partial = {
+        "id": shard.id,
+        "n_homes": len(shard.homes),
+        "p_grid_opt": 0.0,
+        "forecast_p_grid_opt": 0.0,
+        "cost_opt": 0.0,
+        "failed_solves": 0,
+        "bid_curve": np.zeros(len(shard.bid_prices))
+    }
+    for (name, weight, keys), vals in zip(shard.homes, all_vals):
+        partial["p_grid_opt"] += weight * float(vals["p_grid_opt"])
+        partial["forecast_p_grid_opt"] += weight * float(vals["forecast_p_grid_opt"])
+        partial["cost_opt"] += weight * float(vals["cost_opt"])
+        partial["failed_solves"] += 1 - int(float(vals.get("correct_solve", 1)))
+        if len(shard.bid_prices) > 0:
+            partial["bid_curve"] += weight * parse_bid_curve(vals, shard.bid_prices)
+        redis_client.write("rpush", redis_client.key(f"{name}:history"), json.dumps({k: float(vals[k]) for k in keys if k in vals}), pipe=pipe)
+    pipe.execute()
+    return partial
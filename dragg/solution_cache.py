@@ -0,0 +1,100 @@
+import sys
+import threading
+from collections import OrderedDict
+
+class SolutionCache:
+    """
+    Bounded store of MPC plans keyed on a quantized description of the home,
+    its initial state and its inputs. Evicts the least recently used ("lru") or
+    least frequently used ("lfu") entry when full.
+    """
+    def __init__(self, max_size, policy="lru"):
+        self.max_size = int(max_size)
+        self.policy = policy.lower()
+        self.entries = OrderedDict()
+        self.counts = {}
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0 # hits whose plan was infeasible for the actual inputs
+        self.evictions = 0
+        self.nbytes = 0
+        self.lock = threading.Lock() # homes of the thread executor share the cache
+
+    def get(self, key):
+        """
+        :return: the stored plan, or None
+        """
+        with self.lock:
+            if not key in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.counts[key] += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def reject(self):
+        """
+        Records that the plan returned by the last get() could not be used. The
+        lookup is counted as a miss.
+        :return: None
+        """
+        with self.lock:
+            self.hits -= 1
+            self.misses += 1
+            self.rejected += 1
+
+    def put(self, key, plan):
+        """
+        :param plan: dictionary of numpy.ndarray
+        :return: None
+        """
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self._size(key, self.entries[key])
+            elif len(self.entries) >= self.max_size:
+                self.evict()
+            self.entries[key] = plan
+            self.entries.move_to_end(key)
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.nbytes += self._size(key, plan)
+
+    def evict(self):
+        if self.policy == "lfu":
+            key = min(self.entries.keys(), key=lambda k: self.counts[k]) # oldest first on ties
+        else:
+            key = next(iter(self.entries))
+        self.nbytes -= self._size(key, self.entries[key])
+        del self.entries[key]
+        del self.counts[key]
+        self.evictions += 1
+
+    def _size(self, key, plan):
+        return sys.getsizeof(key) + sum(v.nbytes for v in plan.values())
+
+    def stats(self):
+        """
+        :return: dictionary of cache metrics
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected": self.rejected,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "nbytes": self.nbytes
+        }
+
+_solution_cache = None
+
+def get_solution_cache(max_size, policy="lru"):
+    """
+    The cache of the current (worker) process, shared by every home it solves.
+    :return: SolutionCache
+    """
+    global _solution_cache
+    if _solution_cache is None:
+        _solution_cache = SolutionCache(max_size, policy)
+    return _solution_cache
@@ -0,0 +1,142 @@
+import os
+import time
+import multiprocess
+from pathos.pools import ProcessPool
+
+POLL_INTERVAL = 1 # s, how often a task's worker is checked while waiting for its result
+_started = None # queue of the pool's workers on which run_task reports the task it starts
+
+def watch_tasks(started):
+    """
+    Initializer of the pool's workers.
+    :param started: multiprocess.Queue
+    :return: None
+    """
+    global _started
+    _started = started
+
+def run_task(func, item, task_id):
+    """
+    Top level function run by the pool's workers, reports which worker runs
+    the task so that the supervisor notices if that worker dies.
+    :return: the result of func(item)
+    """
+    if _started is not None:
+        _started.put((task_id, os.getpid()))
+    return func(item)
+
+class WorkerDied(Exception):
+    pass
+
+class WorkerSupervisor:
+    """
+    Runs tasks on a pathos process pool with a timeout on each task. Tasks that
+    time out (hung workers), whose worker dies (e.g. a segfault or an OOM kill)
+    or that raise are reported as failed without stopping the others. The pool
+    is replaced after a timeout, to kill the hung worker, and when a worker's
+    peak memory exceeds max_worker_memory.
+    """
+    def __init__(self, n_nodes, task_timeout, max_worker_memory, log):
+        """
+        :param task_timeout: float, seconds to wait for each task once the tasks
+        before it have returned, 0 to wait indefinitely
+        :param max_worker_memory: float, peak resident memory of a worker (MB)
+        above which the pool is recycled, 0 for no limit
+        :param log: logging.Logger
+        """
+        self.n_nodes = n_nodes
+        self.task_timeout = task_timeout if task_timeout > 0 else None
+        self.max_worker_memory = max_worker_memory
+        self.log = log
+        self.restarts = 0
+        self.failures = 0
+        self.n_maps = 0
+        self.started = multiprocess.Queue()
+        self.running = {} # task id: pid of the worker that started it
+
+    def map(self, func, items, name=str):
+        """
+        Like ProcessPool.map, but never raises for a failed task. func must return
+        a dictionary, with "rss" (peak resident memory in kB) to enable the memory limit.
+        :param name: function giving an identifier of an item for the logs
+        :return: tuple (list of results in the order of items, None for a failed
+        item, list of the items that failed)
+        """
+        pool = ProcessPool(nodes=self.n_nodes, initializer=watch_tasks, initargs=(self.started,))
+        self.n_maps += 1
+        self.running = {}
+        tasks = [(item, (self.n_maps, i), pool.apipe(run_task, func, item, (self.n_maps, i))) for i, item in enumerate(items)]
+
+        results = []
+        failed = []
+        restart = False
+        for item, task_id, task in tasks:
+            try:
+                results.append(self.wait(task, task_id))
+            except multiprocess.TimeoutError:
+                self.log.error(f"Task for {name(item)} timed out after {self.task_timeout} s.")
+                results.append(None)
+                failed.append(item)
+                restart = True
+            except WorkerDied as e:
+                self.log.error(f"Task for {name(item)} failed: {e}")
+                results.append(None)
+                failed.append(item)
+            except Exception as e:
+                self.log.error(f"Task for {name(item)} failed: {e}")
+                results.append(None)
+                failed.append(item)
+        self.failures += len(failed)
+
+        if self.max_worker_memory > 0:
+            peak = max([r["rss"] for r in results if r is not None and "rss" in r], default=0) / 1024
+            if peak > self.max_worker_memory:
+                self.log.warning(f"Worker peak memory {peak:.0f} MB is over the limit of {self.max_worker_memory} MB.")
+                restart = True
+
+        if restart:
+            self.restart(pool)
+        return results, failed
+
+    def wait(self, task, task_id):
+        """
+        Waits for a task's result, checking every POLL_INTERVAL that the worker
+        running it is alive, with or without a task timeout.
+        :raises multiprocess.TimeoutError: after task_timeout
+        :raises WorkerDied: if the worker running the task exited
+        :return: the task's result
+        """
+        deadline = None if self.task_timeout is None else time.time() + self.task_timeout
+        while True:
+            wait = POLL_INTERVAL if deadline is None else min(POLL_INTERVAL, max(0, deadline - time.time()))
+            try:
+                return task.get(timeout=wait)
+            except multiprocess.TimeoutError:
+                if deadline is not None and time.time() >= deadline:
+                    raise
+            while not self.started.empty():
+                started_id, pid = self.started.get()
+                if started_id[0] == self.n_maps:
+                    self.running[started_id] = pid
+            pid = self.running.get(task_id)
+            if pid is not None and not task.ready() and not pid in [p.pid for p in multiprocess.active_children()]:
+                raise WorkerDied(f"worker {pid} died")
+
+    def restart(self, pool):
+        """
+        Terminates every worker of the pool so the next map starts a fresh one.
+        :return: None
+        """
+        pool.terminate()
+        pool.clear()
+        self.restarts += 1
+        self.log.warning(f"Restarted the worker pool ({self.restarts} restarts).")
+
+    def summary(self):
+        """
+        :return: dictionary of supervision metrics
+        """
+        return {
+            "restarts": self.restarts,
+            "failures": self.failures
+        }
@@ -0,0 +1,209 @@
+import os
+import json
+import numpy as np
+
+# Local
+from dragg.logger import Logger
+
+class LoadSurrogate:
+    """
+    Ridge regression surrogate of the community's next-step aggregate load.
+    Inputs are the reward price, OAT, GHI, TOU price, time of day and the most
+    recent aggregate loads. Trained from recorded results.json files and
+    optionally refit against the real MPC community during a run.
+    """
+    def __init__(self, config, dt):
+        self.log = Logger("surrogate")
+        self.config = config
+        self.dt = dt
+        self.surrogate_config = self.config['agg']['surrogate']
+        self.n_lags = int(self.surrogate_config.get('n_lags', 4))
+        self.ridge_alpha = float(self.surrogate_config.get('ridge_alpha', 1.0))
+        self.resync_interval = int(self.surrogate_config.get('resync_interval', 0))
+        self.test_fraction = float(self.surrogate_config.get('test_fraction', 0.2))
+
+        self.x = np.zeros((0, self.n_features))
+        self.y = np.zeros(0)
+        self.coef = None
+        self.x_mean = None
+        self.x_std = None
+        self.y_mean = None
+        self.metrics = {}
+        self.resync_errors = []
+
+    def __getstate__(self):
+        """
+        Leaves the logger out of a checkpointed surrogate.
+        :return: dictionary
+        """
+        state = self.__dict__.copy()
+        state.pop("log", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.log = Logger("surrogate")
+
+    @property
+    def n_features(self):
+        return 6 + self.n_lags
+
+    def features(self, rp, oat, ghi, tou, hour, lags):
+        """
+        Builds the input vector for a single timestep.
+        :param hour: float, hour of day (may be fractional for subhourly steps)
+        :param lags: list, most recent aggregate loads, oldest first
+        :return: numpy.ndarray
+        """
+        lags = list(lags)[-self.n_lags:]
+        if len(lags) < self.n_lags:
+            pad = lags[0] if len(lags) > 0 else (self.y_mean if self.y_mean is not None else 0)
+            lags = [pad] * (self.n_lags - len(lags)) + lags
+        tod = 2 * np.pi * hour / 24
+        return np.array([rp, oat, ghi, tou, np.sin(tod), np.cos(tod)] + lags, dtype=float)
+
+    def load_results(self, file):
+        """
+        Converts a results.json file into surrogate training data. The aggregate
+        load is taken from the Summary or, if absent, summed from the per-home
+        p_grid_opt values.
+        :return: tuple of numpy.ndarray (x, y)
+        """
+        with open(file) as f:
+            data = json.load(f)
+
+        summary = data["Summary"]
+        if "p_grid_aggregate" in summary:
+            loads = np.array(summary["p_grid_aggregate"], dtype=float)
+        else:
+            homes = [v for k, v in data.items() if not k == "Summary"]
+            loads = np.sum([h["p_grid_opt"] for h in homes], axis=0)
+
+        n = len(loads)
+        start_hour = int(summary["start_datetime"][-2:])
+        price_key = "TOU" if "TOU" in summary else "SPP"
+        series = {}
+        for k in ["RP", "OAT", "GHI", price_key]:
+            v = summary[k]
+            if len(v) > 0 and isinstance(v[0], list): # written as a 1-tuple
+                v = v[0]
+            series[k] = np.resize(np.array(v, dtype=float), n)
+
+        x = []
+        for t in range(1, n):
+            hour = start_hour + t / self.dt
+            x.append(self.features(series["RP"][t], series["OAT"][t], series["GHI"][t], series[price_key][t], hour, loads[max(0, t - self.n_lags):t]))
+        return np.array(x).reshape(-1, self.n_features), loads[1:]
+
+    def fit_files(self, files):
+        """
+        Trains the surrogate from a list of results.json files and reports its
+        fidelity on a held out tail of each file.
+        :return: None
+        """
+        x_train, y_train, x_test, y_test = [], [], [], []
+        for file in files:
+            if not os.path.isfile(file):
+                self.log.logger.warning(f"Surrogate training file does not exist: {file}")
+                continue
+            x, y = self.load_results(file)
+            n_test = int(len(y) * self.test_fraction)
+            x_train.append(x[:len(y) - n_test])
+            y_train.append(y[:len(y) - n_test])
+            x_test.append(x[len(y) - n_test:])
+            y_test.append(y[len(y) - n_test:])
+
+        if len(x_train) == 0:
+            self.log.logger.error("No surrogate training data found.")
+            return
+
+        self.x = np.concatenate(x_train)
+        self.y = np.concatenate(y_train)
+        self.fit()
+
+        if sum(len(y) for y in y_test) > 0:
+            self.metrics = self.fidelity(self.predict_batch(np.concatenate(x_test)), np.concatenate(y_test))
+            self.metrics["rollout_rmse"] = float(np.mean([self.rollout_rmse(x, y) for x, y in zip(x_test, y_test) if len(y) > 0]))
+        self.metrics["n_train"] = len(self.y)
+        self.log.logger.info(f"Surrogate trained on {len(self.y)} samples. Fidelity: {self.metrics}")
+
+    def fit(self):
+        """
+        Closed form ridge regression on standardized inputs.
+        :return: None
+        """
+        self.x_mean = self.x.mean(axis=0)
+        self.x_std = self.x.std(axis=0)
+        self.x_std[self.x_std == 0] = 1
+        self.y_mean = self.y.mean()
+        x = (self.x - self.x_mean) / self.x_std
+        a = x.T @ x + self.ridge_alpha * np.eye(self.n_features)
+        self.coef = np.linalg.solve(a, x.T @ (self.y - self.y_mean))
+
+    def predict_batch(self, x):
+        return ((x - self.x_mean) / self.x_std) @ self.coef + self.y_mean
+
+    def predict(self, x):
+        """
+        :return: float, predicted aggregate load
+        """
+        return float(self.predict_batch(x[None, :])[0])
+
+    def rollout_rmse(self, x, y):
+        """
+        Error when the surrogate is stepped on its own predictions (as it is
+        during RL training) rather than on the recorded loads.
+        :return: float
+        """
+        x = x.copy()
+        pred = np.zeros(len(y))
+        for t in range(len(y)):
+            if t > 0 and self.n_lags > 0:
+                x[t, 6:] = np.concatenate((x[t-1, 7:], [pred[t-1]]))
+            pred[t] = self.predict(x[t])
+        return float(np.sqrt(np.mean((pred - y)**2)))
+
+    def fidelity(self, pred, actual):
+        """
+        :return: dictionary of error metrics
+        """
+        err = pred - actual
+        ss_tot = np.sum((actual - actual.mean())**2)
+        return {
+            "rmse": float(np.sqrt(np.mean(err**2))),
+            "mae": float(np.mean(np.abs(err))),
+            "mape": float(np.mean(np.abs(err) / np.maximum(np.abs(actual), 1e-6))),
+            "r2": float(1 - np.sum(err**2) / ss_tot) if ss_tot > 0 else 0.0
+        }
+
+    def due_for_resync(self, timestep):
+        """
+        True if the real community should be stepped at this timestep.
+        :return: bool
+        """
+        if self.coef is None:
+            return True
+        return self.resync_interval > 0 and timestep % self.resync_interval == 0
+
+    def observe(self, x, actual):
+        """
+        Records a timestep run by the real community, tracks the surrogate error
+        on it and refits with the new sample.
+        :return: None
+        """
+        if self.coef is not None:
+            self.resync_errors.append(self.predict(x) - actual)
+        self.x = np.vstack((self.x, x))
+        self.y = np.append(self.y, actual)
+        if len(self.y) > self.n_features:
+            self.fit()
+
+    def summary(self):
+        """
+        :return: dictionary of fidelity metrics for the run Summary
+        """
+        temp = dict(self.metrics)
+        if len(self.resync_errors) > 0:
+            temp["resync_rmse"] = float(np.sqrt(np.mean(np.square(self.resync_errors))))
+            temp["n_resync"] = len(self.resync_errors)
+        return temp
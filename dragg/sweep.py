@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import toml
+import itertools as it
+import multiprocessing
+from multiprocessing.connection import wait
+from copy import deepcopy
+
+# Local
+from dragg.aggregator import Aggregator
+from dragg.logger import Logger
+
+def set_config_value(config, key, value):
+    """
+    :param key: str, dotted path of the parameter in the config, e.g.
+    "home.hems.prediction_horizon"
+    :return: None
+    """
+    *sections, name = key.split('.')
+    for section in sections:
+        config = config[section]
+    config[name] = value
+
+def run_case(config, shared_data):
+    """
+    Top level function run in the process of each case.
+    :return: None
+    """
+    agg = Aggregator(config=config, shared_data=shared_data)
+    agg.run()
+    agg.executor.close()
+
+class ParameterSweep:
+    """
+    Runs the aggregator for every combination of the values listed in
+    [sweep.parameters], as many cases at a time as fit in max_cores. The weather
+    (and SPP) data and the home populations are parsed and generated once in this
+    process, before the case processes are forked, so the cases share them. Each
+    case writes to the usual run directory under a version named after its
+    parameters, and uses a redis namespace of its own.
+    """
+    config_section = "sweep"
+
+    def __init__(self):
+        self.log = Logger(self.config_section)
+        data_dir = os.path.expanduser(os.environ.get('DATA_DIR','data'))
+        self.config_file = os.path.join(data_dir, os.environ.get('CONFIG_FILE', 'config.toml'))
+        if not os.path.exists(self.config_file):
+            self.log.logger.error(f"Configuration file does not exist: {self.config_file}")
+            sys.exit(1)
+        with open(self.config_file, 'r') as f:
+            self.config = toml.load(f)
+        self.sweep_config = self.config.get(self.config_section, {})
+        self.max_cores = int(self.sweep_config.get('max_cores', 0)) or os.cpu_count()
+        self.cases = self.set_cases()
+        self.shared_data = {"ts_data": {}, "spp_data": {}, "homes": {}}
+        self.results = []
+
+    def set_cases(self):
+        """
+        Expands the lists of [sweep.parameters] into one config per combination.
+        :return: list of dictionaries
+        """
+        parameters = self.sweep_config.get('parameters', {})
+        keys = list(parameters.keys())
+        cases = []
+        for values in it.product(*[parameters[k] for k in keys]):
+            overrides = dict(zip(keys, values))
+            labels = [f"{k.split('.')[-1]}_{v}" for k, v in overrides.items() if k != "simulation.named_version"]
+            version = overrides.get("simulation.named_version", self.config['simulation']['named_version'])
+            cases.append(self.set_case('-'.join([str(version)] + labels).replace(' ', ''), overrides))
+        return cases
+
+    def set_case(self, version, overrides):
+        """
+        :param version: str, named_version of the case, also its redis namespace
+        :param overrides: dictionary, dotted config path: value
+        :return: dictionary, the case
+        """
+        config = deepcopy(self.config)
+        for k, v in overrides.items():
+            try:
+                set_config_value(config, k, v)
+            except (KeyError, TypeError):
+                self.log.logger.error(f"Parameter {k} of case {version} is not in the config file.")
+                sys.exit(1)
+        config['simulation']['named_version'] = version
+        namespace = self.config['simulation'].get('redis_namespace', '')
+        config['simulation']['redis_namespace'] = f"{namespace}:{version}" if namespace else version
+        return {
+            "version": version,
+            "parameters": overrides,
+            "config": config,
+            "cores": self.case_cores(config)
+        }
+
+    def case_cores(self, config):
+        """
+        :return: int, number of cores a case uses on this machine
+        """
+        if config['simulation'].get('executor', 'process') in ["process", "thread"]:
+            return int(min(config['simulation']['n_nodes'], self.max_cores))
+        return 1
+
+    def case_run_dir(self, case):
+        """
+        :return: str, run directory of a case
+        """
+        agg = Aggregator(config=deepcopy(case["config"]), shared_data=self.shared_data)
+        agg.version = case["version"]
+        agg.set_run_dir()
+        agg.executor.close()
+        return agg.run_dir
+
+    def load_shared_data(self, cases):
+        """
+        Parses the data and generates the homes of every case, once for each
+        subhourly_steps and home population.
+        :return: None
+        """
+        for case in cases:
+            agg = Aggregator(config=deepcopy(case["config"]), shared_data=self.shared_data)
+            if not agg.population_key() in self.shared_data["homes"]:
+                agg.flush_redis() # homes read the environmental data from redis
+                agg.get_homes()
+                agg.redis_client.flush()
+            agg.executor.close()
+        self.log.logger.info(f"Parsed data for {len(self.shared_data['ts_data'])} subhourly step(s) and {len(self.shared_data['homes'])} home population(s).")
+
+    def run(self):
+        """
+        Runs every case.
+        :return: None
+        """
+        start = time.time()
+        self.load_shared_data(self.cases)
+        self.run_cases(self.cases, run_case)
+        self.write_results(time.time() - start)
+
+    def run_cases(self, cases, target, *args):
+        """
+        Runs target(case config, shared data, *args) for every case in a forked
+        process, starting the next case whenever enough cores are free.
+        :return: None
+        """
+        ctx = multiprocessing.get_context("fork")
+        pending = list(cases)
+        running = [] # (case, process, start time)
+        used_cores = 0
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and (used_cores + pending[0]["cores"] <= self.max_cores or len(running) == 0):
+                case = pending.pop(0)
+                p = ctx.Process(target=target, args=(case["config"], self.shared_data) + args, name=case["version"])
+                p.start()
+                running.append((case, p, time.time()))
+                used_cores += case["cores"]
+                self.log.logger.info(f"Started case {case['version']} ({used_cores} of {self.max_cores} cores in use).")
+
+            finished = wait([p.sentinel for _, p, _ in running])
+            for case, p, case_start in [r for r in running if r[1].sentinel in finished]:
+                p.join()
+                running.remove((case, p, case_start))
+                used_cores -= case["cores"]
+                self.results.append({
+                    "version": case["version"],
+                    "parameters": case["parameters"],
+                    "exitcode": p.exitcode,
+                    "wall_time": time.time() - case_start
+                })
+                if p.exitcode != 0:
+                    self.log.logger.error(f"Case {case['version']} failed with exit code {p.exitcode}.")
+                else:
+                    self.log.logger.info(f"Finished case {case['version']} in {time.time() - case_start:.1f} s.")
+
+    def write_results(self, wall_time):
+        """
+        Writes the cases, their exit code and wall time to
+        outputs/<config_section>-<named_version>.json.
+        :return: None
+        """
+        outputs_dir = os.path.join('outputs')
+        if not os.path.isdir(outputs_dir):
+            os.makedirs(outputs_dir)
+        file = os.path.join(outputs_dir, f"{self.config_section}-{self.config['simulation']['named_version']}.json")
+        with open(file, 'w+') as f:
+            json.dump({"max_cores": self.max_cores, "wall_time": wall_time, "cases": self.results}, f, indent=4)
+
+if __name__ == "__main__":
+    sweep = ParameterSweep()
+    sweep.run()
@@ -0,0 +1,113 @@
+import os
+import json
+import argparse
+import redis
+import multiprocessing
+
+# Local
+from dragg.redis_client import RedisClient
+from dragg.logger import Logger
+from dragg.executors import TASK_QUEUE, PROCESSING_QUEUE, encode, decode, lease_key
+
+def keep_leases(leases, worker):
+    """
+    Heartbeat process of a worker, renews the lease of the worker's current task
+    every second (or third of its ttl if shorter). The solvers hold the GIL, so a
+    thread of the solving process could not renew it during a solve.
+    :param leases: multiprocessing.Connection receiving (redis key, ttl in s) of
+    each task the worker takes, None once it finished (a pipe, the feeder thread
+    of a multiprocessing.Queue would wait for the GIL too)
+    :param worker: int, pid of the worker, the heartbeat stops with it so that the
+    task of a killed worker is requeued
+    :return: None
+    """
+    redis_client = RedisClient()
+    lease = None
+    while os.getppid() == worker:
+        if leases.poll(1 if lease is None else min(1, lease[1] / 3)):
+            lease = leases.recv()
+        elif lease is not None:
+            redis_client.conn.pexpire(lease[0], int(lease[1] * 1000))
+
+def post_result(redis_client, processing_queue, message, task, result, writes):
+    """
+    Posts the result of a task with its redis writes, in one transaction, unless
+    the task was requeued (lease expired) in the meantime. The writes of a lost
+    attempt are then dropped, so that a home's state only advances once.
+    :param writes: list of the task's deferred commands, see RedisClient.write
+    :return: bool, True if the result was posted
+    """
+    with redis_client.conn.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(processing_queue)
+                if pipe.lpos(processing_queue, message) is None: # requeued, another worker posts the result
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.lrem(processing_queue, 1, message)
+                for command, args, kwargs in writes:
+                    getattr(pipe, command)(*args, **kwargs)
+                pipe.hset(redis_client.key(f"dragg:results:{task['batch']}"), task["id"], encode(result))
+                pipe.rpush(redis_client.key(f"dragg:done:{task['batch']}"), task["id"])
+                pipe.execute()
+                return True
+            except redis.WatchError: # another worker took or finished a task
+                continue
+
+def run_worker(max_tasks=None, namespace=None):
+    """
+    Serves RedisQueueExecutor tasks from the redis server at REDIS_HOST.
+    :param max_tasks: int, number of tasks after which to stop, None to serve
+    until interrupted
+    :param namespace: str, redis namespace of the simulation to serve, None for
+    REDIS_NAMESPACE
+    :return: None
+    """
+    log = Logger("worker").logger
+    if not os.path.isdir('home_logs'):
+        os.makedirs('home_logs')
+    redis_client = RedisClient()
+    if namespace is not None:
+        redis_client.namespace = namespace
+    task_queue = redis_client.key(TASK_QUEUE)
+    processing_queue = redis_client.key(PROCESSING_QUEUE)
+    heartbeat, leases = multiprocessing.Pipe(duplex=False)
+    multiprocessing.Process(target=keep_leases, args=(heartbeat, os.getpid()), daemon=True).start()
+    n_tasks = 0
+    while max_tasks is None or n_tasks < max_tasks:
+        message = redis_client.conn.blmove(task_queue, processing_queue, 5, "LEFT", "RIGHT")
+        if message is None:
+            continue
+        task = json.loads(message)
+        key = redis_client.key(lease_key(task))
+        redis_client.conn.set(key, os.getpid(), px=int(task["lease"] * 1000))
+        leases.send((key, task["lease"]))
+        redis_client.defer_writes()
+        try:
+            func, item = decode(task["task"])
+            result = {"result": func(item)}
+        except Exception as e:
+            log.error(f"Task {task['id']} of batch {task['batch']} failed in worker {os.getpid()}: {e}")
+            result = {"error": repr(e)}
+        finally:
+            writes = redis_client.pop_writes()
+            leases.send(None)
+
+        if not post_result(redis_client, processing_queue, message, task, result, writes if "result" in result else []):
+            log.warning(f"Task {task['id']} of batch {task['batch']} was requeued before it finished, dropped its result.")
+        redis_client.conn.delete(key)
+        n_tasks += 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves the home MPC solves of an aggregator run with executor = \"redis\".")
+    parser.add_argument("--n-procs", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--max-tasks", type=int, default=None, help="number of tasks after which each process stops")
+    parser.add_argument("--namespace", type=str, default=None, help="redis namespace of the simulation to serve (default: REDIS_NAMESPACE)")
+    args = parser.parse_args()
+
+    procs = [multiprocessing.Process(target=run_worker, args=(args.max_tasks, args.namespace)) for _ in range(args.n_procs)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()